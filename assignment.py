@@ -0,0 +1,255 @@
+import numpy as np
+import time
+
+# Amount of datapoints whose distances to every central point are
+# computed at once, it bounds the size of the temporary [chunk, k]
+# distance matrix and therefore the peak memory of an assignment pass
+CHUNK_SIZE = 4096
+
+# Relative margin a distance bound has to clear before a central point
+# is ruled out for a datapoint, it covers the float32 rounding of the
+# distances so the engines and tables that prune with bounds give the
+# same clusters a full assignment gives
+BOUND_MARGIN = 1e-5
+
+def pairwise_distances(data, c_means, distance_f, squared = False):
+	"""
+	returns the distance from every datapoint to every central point,
+	using the N x K kernel exposed as distance_f.pairwise when there is
+	one
+
+	Arguments:
+	data: numpy 2d numerical array
+	c_means: numpy 2d numerical array
+	distance_f: function of datapoint x datapoint -> float
+	squared: bool, return squared distances
+
+	Output:
+	distances: numpy 2d numerical array with shape [n, k]
+	"""
+	pairwise_f = getattr(distance_f, 'pairwise', None)
+	if(pairwise_f is not None):
+		return pairwise_f(data, c_means, squared)
+
+	n = data.shape[0]
+	k = c_means.shape[0]
+
+	# Pair every datapoint with every central point so distance_f
+	# is called only once for the whole block
+	distances = distance_f(
+		np.repeat(data, k, axis = 0),
+		np.tile(c_means, [n, 1])
+	).reshape([n, k])
+
+	if(squared):
+		distances = distances*distances
+
+	return distances
+
+def assign(data, c_means, clusters, distance_f, chunk_size = CHUNK_SIZE):
+	"""
+	assigns every datapoint to the cluster whose central point is the
+	nearest, processing the data in blocks of chunk_size datapoints and
+	writing the cluster ids into clusters
+
+	Arguments:
+	data: numpy 2d numerical array
+	c_means: numpy 2d numerical array
+	clusters: numpy 1d numerical array
+	distance_f: function of datapoint x datapoint -> float
+	chunk_size: int
+	"""
+	if(chunk_size < 1):
+		raise ValueError('chunk_size must be positive, got {}'.format(chunk_size))
+
+	n = data.shape[0]
+	for start in range(0, n, chunk_size):
+		end = min(start + chunk_size, n)
+		# Squared distances have the same argmin and save the sqrt
+		distances = pairwise_distances(data[start:end], c_means, distance_f, True)
+		clusters[start:end] = np.argmin(distances, axis = 1)
+
+def get_sums(data, clusters, k, weights = None):
+	"""
+	returns the sum and the count of the datapoints of every cluster
+
+	Arguments:
+	data: numpy 2d numerical array
+	clusters: numpy 1d numerical array
+	k: int
+	weights: numpy 1d numerical array, amount of times each datapoint
+	appears, None counts every datapoint once
+
+	Output:
+	sums: numpy 2d float64 array
+	count: numpy 1d float64 array
+	"""
+	count = np.bincount(clusters, weights = weights, minlength = k)
+
+	# Per cluster sums, one channel at a time
+	sums = np.zeros([k, data.shape[1]], dtype = np.float64)
+	for j in range(data.shape[1]):
+		if(weights is None):
+			channel = data[:, j]
+		else:
+			channel = data[:, j] * weights
+		sums[:, j] = np.bincount(clusters, weights = channel, minlength = k)
+
+	return sums, count
+
+def own_distances(data, c_means, clusters, distance_f):
+	"""
+	returns the squared distance from every datapoint to the central
+	point of its cluster, computed with the same kernel as assign so the
+	values are exactly the ones a full assignment pass gives
+
+	Arguments:
+	data: numpy 2d numerical array
+	c_means: numpy 2d numerical array
+	clusters: numpy 1d numerical array
+	distance_f: function of datapoint x datapoint -> float
+
+	Output:
+	distances: numpy 1d float64 array
+	"""
+	k = c_means.shape[0]
+	distances = np.ndarray([data.shape[0]], dtype = np.float64)
+
+	# Members of every cluster against their own central point only
+	order = np.argsort(clusters, kind = 'mergesort')
+	count = np.bincount(clusters, minlength = k)
+	ends = np.cumsum(count)
+	for j in range(k):
+		members = order[ends[j] - count[j]:ends[j]]
+		if(members.shape[0] > 0):
+			distances[members] = pairwise_distances(data[members], c_means[j:j + 1], distance_f, True)[:, 0]
+
+	return distances
+
+def squared_error(data, c_means, clusters, distance_f, weights = None, chunk_size = CHUNK_SIZE):
+	"""
+	returns the sum of the squared distances from every datapoint to the
+	central point of its cluster, added in the same blocks and order as
+	assign_accumulate so both give the same value for the same clusters
+
+	Arguments:
+	data: numpy 2d numerical array
+	c_means: numpy 2d numerical array
+	clusters: numpy 1d numerical array
+	distance_f: function of datapoint x datapoint -> float
+	weights: numpy 1d numerical array or None
+	chunk_size: int
+
+	Output:
+	sq_error: float
+	"""
+	distances = own_distances(data, c_means, clusters, distance_f)
+
+	sq_error = 0.0
+	for start in range(0, data.shape[0], chunk_size):
+		end = min(start + chunk_size, data.shape[0])
+		if(weights is None):
+			sq_error += np.sum(distances[start:end])
+		else:
+			sq_error += np.sum(distances[start:end] * weights[start:end])
+
+	return sq_error
+
+def accumulate_chunk(data, c_means, clusters, distance_f, weights, start, end):
+	"""
+	assigns data[start:end] and returns its partial cluster sums, counts
+	and squared error together with the time it took
+
+	Arguments:
+	data: numpy 2d numerical array
+	c_means: numpy 2d numerical array
+	clusters: numpy 1d numerical array
+	distance_f: function of datapoint x datapoint -> float
+	weights: numpy 1d numerical array or None
+	start: int
+	end: int
+
+	Output:
+	sums: numpy 2d float64 array with shape [k, d]
+	count: numpy 1d float64 array with shape [k]
+	sq_error: float
+	busy: float
+	"""
+	# CPU time of this thread, so waiting for a core is not counted
+	t0 = time.thread_time()
+	k = c_means.shape[0]
+	block = data[start:end]
+
+	distances = pairwise_distances(block, c_means, distance_f, True)
+	nearest = np.argmin(distances, axis = 1)
+	clusters[start:end] = nearest
+	min_distances = distances[np.arange(end - start), nearest].astype(np.float64)
+
+	if(weights is None):
+		block_weights = None
+		sq_error = np.sum(min_distances)
+	else:
+		block_weights = weights[start:end]
+		sq_error = np.sum(min_distances * block_weights)
+
+	sums, count = get_sums(block, nearest, k, block_weights)
+
+	return sums, count, sq_error, time.thread_time() - t0
+
+def assign_accumulate(data, c_means, clusters, distance_f, weights = None, chunk_size = CHUNK_SIZE, executor = None, stats = None):
+	"""
+	fused Lloyd pass, in a single pass over blocks of chunk_size
+	datapoints it assigns every datapoint to its nearest central point
+	and accumulates the sum and count of every cluster together with the
+	sum of the squared distances to the assigned central points
+
+	Blocks are run on executor when given, their partial results are
+	always added in block order so they don't depend on the amount of
+	workers
+
+	Arguments:
+	data: numpy 2d numerical array
+	c_means: numpy 2d numerical array
+	clusters: numpy 1d numerical array
+	distance_f: function of datapoint x datapoint -> float
+	weights: numpy 1d numerical array, amount of times each datapoint
+	appears, None counts every datapoint once
+	chunk_size: int
+	executor: concurrent.futures.Executor or None
+	stats: dict of string -> float or None, 'busy' is increased by the
+	time spent on the blocks
+
+	Output:
+	sums: numpy 2d float64 array with shape [k, d]
+	count: numpy 1d float64 array with shape [k]
+	sq_error: float
+	"""
+	if(chunk_size < 1):
+		raise ValueError('chunk_size must be positive, got {}'.format(chunk_size))
+
+	n = data.shape[0]
+	bounds = [(start, min(start + chunk_size, n)) for start in range(0, n, chunk_size)]
+	if(executor is None):
+		partials = [accumulate_chunk(data, c_means, clusters, distance_f, weights, start, end) for start, end in bounds]
+	else:
+		futures = [
+			executor.submit(accumulate_chunk, data, c_means, clusters, distance_f, weights, start, end)
+			for start, end in bounds
+		]
+		partials = [future.result() for future in futures]
+
+	k = c_means.shape[0]
+	sums = np.zeros([k, data.shape[1]], dtype = np.float64)
+	count = np.zeros([k], dtype = np.float64)
+	sq_error = 0.0
+	busy = 0.0
+	for chunk_sums, chunk_count, chunk_error, chunk_busy in partials:
+		sums += chunk_sums
+		count += chunk_count
+		sq_error += chunk_error
+		busy += chunk_busy
+
+	if(stats is not None):
+		stats['busy'] = stats.get('busy', 0.0) + busy
+
+	return sums, count, sq_error
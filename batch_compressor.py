@@ -0,0 +1,285 @@
+from image_compressor import compress_image
+from kmeans import ENGINES
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import argparse
+import glob
+import time
+import cv2
+import os
+import sys
+import utils
+
+def expand_inputs(inputs):
+	"""
+	returns the image paths found in a list of files, directories and
+	glob patterns, without repetitions and in the order found
+
+	Arguments:
+	inputs: list of string
+
+	Output:
+	im_paths: list of string
+	"""
+	im_paths = []
+	for item in inputs:
+		if(os.path.isdir(item)):
+			found = [os.path.join(item, file) for file in sorted(os.listdir(item))]
+			found = [path for path in found if os.path.splitext(path)[1].lower() in utils.IMAGE_EXTENSIONS]
+		elif(os.path.isfile(item)):
+			found = [item]
+		else:
+			found = sorted(glob.glob(item))
+
+		for path in found:
+			if(path not in im_paths):
+				im_paths.append(path)
+
+	return im_paths
+
+def output_names(im_paths):
+	"""
+	returns the name the outputs of every image are written under, its
+	path without extension relative to the deepest directory holding
+	every image, so images with the same file name in different
+	directories don't overwrite each other
+
+	Arguments:
+	im_paths: list of string
+
+	Output:
+	out_names: list of string
+	"""
+	abs_paths = [os.path.abspath(im_path) for im_path in im_paths]
+	common = os.path.commonpath([os.path.dirname(path) for path in abs_paths])
+	out_names = [os.path.relpath(os.path.splitext(path)[0], common) for path in abs_paths]
+
+	# Only the extension differs, like a.png and a.jpg in one directory
+	seen = {}
+	for im_path, out_name in zip(im_paths, out_names):
+		if(out_name in seen):
+			raise ValueError('{} and {} would be written to the same outputs'.format(seen[out_name], im_path))
+		seen[out_name] = im_path
+
+	return out_names
+
+def init_worker(vlevel):
+	"""
+	sets the verbosity level of a worker process
+	"""
+	utils.vlevel = vlevel
+
+def compress_job(im_path, out_name, k, out_dir, write_original, kmeans_args):
+	"""
+	compresses one image with k colors and writes the result into
+	out_dir under out_name, returns the job statistics instead of the
+	images so they don't have to travel back to the main process
+
+	Arguments:
+	im_path: string
+	out_name: string, from output_names
+	k: int
+	out_dir: string
+	write_original: bool
+	kmeans_args: dict of keyword arguments for kmeans.k_means
+
+	Output:
+	job: dict of string -> value
+	"""
+	t0 = time.perf_counter()
+	image, compressed_image, mse, aid, time_profile = compress_image(im_path, k, return_original = write_original, **kmeans_args)
+
+	out_prefix = os.path.join(out_dir, out_name)
+	if(write_original):
+		cv2.imwrite('{}_original.png'.format(out_prefix), image)
+	cv2.imwrite('{}_{}colors.png'.format(out_prefix, k), compressed_image)
+	t1 = time.perf_counter()
+
+	return {
+		'image': im_path,
+		'colors': k,
+		'pixels': compressed_image.shape[0] * compressed_image.shape[1],
+		'mse': mse,
+		'aid': aid,
+		'time': t1 - t0,
+		'time_profile': time_profile
+	}
+
+def compress_batch(im_paths, ks, out_dir, processes = None, max_in_flight = None, vlevel = 0, **kmeans_args):
+	"""
+	compresses every image with every amount of colors on a process
+	pool, at most max_in_flight jobs are submitted at any time so only
+	that many decoded images are held in memory, outputs are written by
+	the workers as jobs finish, the outputs keep the directories of the
+	images relative to the deepest one holding all of them, a job that
+	raises is recorded as failed and the rest of the batch goes on
+
+	Arguments:
+	im_paths: list of string
+	ks: list of int
+	out_dir: string
+	processes: int, None uses every core
+	max_in_flight: int, None allows two jobs per process
+	vlevel: int, verbosity level of the workers
+	kmeans_args: keyword arguments for kmeans.k_means
+
+	Output:
+	jobs: list of dict of string -> value, in completion order
+	failures: list of dict of string -> value, image, colors and error of
+	every failed job
+	summary: dict of string -> float
+	"""
+	if(processes is None):
+		processes = os.cpu_count()
+	if(max_in_flight is None):
+		max_in_flight = 2 * processes
+
+	out_names = output_names(im_paths)
+	for out_name in out_names:
+		directory = os.path.join(out_dir, os.path.dirname(out_name))
+		if(not os.path.isdir(directory)):
+			os.makedirs(directory)
+
+	# The job with the first k of every image writes its original
+	pending = [
+		(im_path, out_name, k, i == 0)
+		for im_path, out_name in zip(im_paths, out_names)
+		for i, k in enumerate(ks)
+	]
+	pending.reverse()
+	jobs = []
+	failures = []
+
+	t0 = time.perf_counter()
+	with ProcessPoolExecutor(processes, initializer = init_worker, initargs = (vlevel,)) as executor:
+		# Future of every submitted job and its image and k
+		in_flight = {}
+		while(pending or in_flight):
+			while(pending and len(in_flight) < max_in_flight):
+				im_path, out_name, k, write_original = pending.pop()
+				future = executor.submit(compress_job, im_path, out_name, k, out_dir, write_original, kmeans_args)
+				in_flight[future] = (im_path, k)
+
+			done, _ = wait(in_flight, return_when = FIRST_COMPLETED)
+			for future in done:
+				im_path, k = in_flight.pop(future)
+				try:
+					job = future.result()
+				except Exception as e:
+					failures.append({'image': im_path, 'colors': k, 'error': '{}: {}'.format(type(e).__name__, e)})
+					utils.vprint('{} {} colors: failed, {}'.format(im_path, k, e), 1)
+					continue
+				jobs.append(job)
+				utils.vprint('{} {} colors: {:.3f}s'.format(job['image'], job['colors'], job['time']), 1)
+	t1 = time.perf_counter()
+
+	# Every image is counted once for the throughput, not once per k,
+	# failed jobs are left out
+	wall = t1 - t0
+	image_pixels = dict((job['image'], job['pixels']) for job in jobs)
+	total_pixels = sum(image_pixels.values())
+	summary = {
+		'jobs': len(jobs),
+		'failed': len(failures),
+		'wall_time': wall,
+		'jobs_per_second': len(jobs) / wall,
+		'images_per_second': len(image_pixels) / wall,
+		'pixels_per_second': total_pixels / wall
+	}
+
+	return jobs, failures, summary
+
+if __name__ == '__main__':
+
+	# Script arguments
+	ap = argparse.ArgumentParser(
+		description = 'Compress many images with specified amounts of colors'
+	)
+	ap.add_argument(
+		'-i',
+		'--images',
+		required = True,
+		nargs = '+',
+		help = 'Image files, directories or glob patterns'
+	)
+	ap.add_argument(
+		'-c',
+		'--colors',
+		required = True,
+		type = int,
+		nargs = '+',
+		help = 'Number of colors'
+	)
+	ap.add_argument(
+		'-o',
+		'--output',
+		default = './compressed',
+		help = 'Output directory'
+	)
+	ap.add_argument(
+		'-p',
+		'--processes',
+		type = int,
+		default = None,
+		help = 'Worker processes, every core by default'
+	)
+	ap.add_argument(
+		'--max-in-flight',
+		type = int,
+		default = None,
+		help = 'Maximum amount of jobs held in memory, twice the processes by default'
+	)
+	ap.add_argument(
+		'-e',
+		'--engine',
+		default = 'lloyd',
+		choices = ENGINES,
+		help = 'k-means engine'
+	)
+	ap.add_argument(
+		'-w',
+		'--weighted',
+		action = 'store_true',
+		help = 'Weight every color by its pixel count'
+	)
+	ap.add_argument(
+		'-v',
+		'--verbosity',
+		type = int,
+		default = 1,
+		help = 'Verbosity level'
+	)
+	args = ap.parse_args()
+
+	utils.vlevel = args.verbosity
+	im_paths = expand_inputs(args.images)
+	if(len(im_paths) == 0):
+		raise ValueError('No images found in {}'.format(args.images))
+
+	print('Compressing', len(im_paths), 'images with', args.colors, 'colors')
+	jobs, failures, summary = compress_batch(
+		im_paths, args.colors, args.output,
+		processes = args.processes,
+		max_in_flight = args.max_in_flight,
+		# Workers only report the per-job line printed here
+		vlevel = 0,
+		engine = args.engine,
+		weighted = args.weighted
+	)
+
+	print('Job timings')
+	for job in jobs:
+		print('{}, {} colors: {:.3f}s, k_means {:.3f}s, MSE {}'.format(
+			job['image'], job['colors'], job['time'], job['time_profile']['k_means'], job['mse']
+		))
+
+	if(failures):
+		print('Failed jobs')
+		for failure in failures:
+			print('{}, {} colors: {}'.format(failure['image'], failure['colors'], failure['error']))
+
+	print('Summary')
+	for metric, value in summary.items():
+		print('{}: {}'.format(metric, value))
+
+	if(failures):
+		sys.exit(1)
@@ -0,0 +1,87 @@
+import numpy as np
+from assignment import pairwise_distances, CHUNK_SIZE, BOUND_MARGIN
+
+class HamerlyAssigner(object):
+	"""
+	Hamerly's accelerated assignment, keeps for every datapoint an upper
+	bound to the distance to its own central point and a lower bound to
+	the distance to any other one, a datapoint whose upper bound is
+	below its lower bound keeps its cluster without computing distances
+
+	The bounds are moved by distance_f.lipschitz times the euclidean
+	shift of the central points, which does not need distance_f to obey
+	the triangle inequality
+	"""
+
+	def __init__(self, data, distance_f, chunk_size = CHUNK_SIZE):
+		self.lipschitz = getattr(distance_f, 'lipschitz', None)
+		if(self.lipschitz is None):
+			error_msg = 'The accelerated assignment needs a distance function'
+			error_msg += ' with a lipschitz attribute'
+			raise ValueError(error_msg)
+
+		self.data = data
+		self.distance_f = distance_f
+		self.chunk_size = chunk_size
+		self.upper = np.ndarray([data.shape[0]], dtype = np.float64)
+		self.lower = np.ndarray([data.shape[0]], dtype = np.float64)
+		self.old_means = None
+		self.evaluations = 0
+		self.skipped = 0
+
+	def assign(self, c_means, clusters):
+		"""
+		same as assignment.assign, updating the bounds
+
+		Arguments:
+		c_means: numpy 2d numerical array
+		clusters: numpy 1d numerical array
+		"""
+		n = self.data.shape[0]
+		k = c_means.shape[0]
+		evaluations = 0
+		skipped = 0
+
+		if(self.old_means is None):
+			candidates = np.arange(n)
+		else:
+			# Worst change of the distance from any datapoint to every
+			# central point and the largest one among the others
+			drift = self.lipschitz * np.sqrt(np.sum((c_means - self.old_means)**2, axis = 1))
+			order = np.argsort(drift)[::-1]
+			other_drift = np.full([k], drift[order[0]])
+			if(k > 1):
+				other_drift[order[0]] = drift[order[1]]
+
+			self.upper += drift[clusters]
+			self.lower -= other_drift[clusters]
+			candidates = np.flatnonzero(self.upper >= self.lower * (1 - BOUND_MARGIN))
+			# Datapoints kept by the bounds skip every distance
+			skipped += (n - candidates.shape[0]) * k
+
+			# Tighten the upper bound with the actual distance to the
+			# own central point before looking at the rest of them
+			own = self.distance_f(self.data[candidates], c_means[clusters[candidates]])
+			evaluations += candidates.shape[0]
+			self.upper[candidates] = own
+			tightened = candidates.shape[0]
+			candidates = candidates[own >= self.lower[candidates] * (1 - BOUND_MARGIN)]
+			# Datapoints kept after tightening skip all but their own one
+			skipped += (tightened - candidates.shape[0]) * (k - 1)
+
+		for start in range(0, candidates.shape[0], self.chunk_size):
+			idx = candidates[start:start + self.chunk_size]
+			rows = np.arange(idx.shape[0])
+
+			distances = pairwise_distances(self.data[idx], c_means, self.distance_f, True)
+			nearest = np.argmin(distances, axis = 1)
+			clusters[idx] = nearest
+
+			self.upper[idx] = np.sqrt(distances[rows, nearest])
+			distances[rows, nearest] = np.inf
+			self.lower[idx] = np.sqrt(np.min(distances, axis = 1))
+
+		evaluations += candidates.shape[0] * k
+		self.evaluations += evaluations
+		self.skipped += skipped
+		self.old_means = c_means.astype(np.float64)
@@ -0,0 +1,174 @@
+import numpy as np
+from assignment import pairwise_distances, get_sums, BOUND_MARGIN
+
+# Maximum amount of datapoints in a leaf, leaves are assigned with a
+# vectorized distance computation against their remaining candidates
+LEAF_SIZE = 256
+
+class KdTreeAssigner(object):
+	"""
+	filtering algorithm (Kanungo et al.), builds a kd-tree over the
+	datapoints once storing the weighted sum and count of every node and
+	on every assignment walks it with a set of candidate central points,
+	discarding the candidates that cannot be the nearest to any point of
+	the node's bounding box, once a single candidate is left the whole
+	node is assigned to it without looking at its datapoints
+
+	The bounds come from distance_f.box_bounds so the distance does not
+	need to be euclidean
+	"""
+
+	def __init__(self, data, distance_f, weights = None, leaf_size = LEAF_SIZE):
+		self.box_bounds = getattr(distance_f, 'box_bounds', None)
+		if(self.box_bounds is None):
+			error_msg = 'The kd-tree engine needs a distance function'
+			error_msg += ' with a box_bounds attribute'
+			raise ValueError(error_msg)
+
+		if(weights is None):
+			weights = np.ones([data.shape[0]], dtype = np.uint32)
+
+		self.distance_f = distance_f
+		self.leaf_size = leaf_size
+		self.perm = np.arange(data.shape[0])
+
+		# Node arrays, filled by build
+		self.start = []
+		self.end = []
+		self.lo = []
+		self.hi = []
+		self.children = []
+		self.build(data, 0, data.shape[0])
+
+		# Datapoints in tree order, every node is a contiguous range
+		self.data = data[self.perm]
+		self.weights = weights[self.perm].astype(np.float64)
+		self.node_sums = np.ndarray([len(self.start), data.shape[1]], dtype = np.float64)
+		self.node_counts = np.ndarray([len(self.start)], dtype = np.float64)
+		for node in range(len(self.start)):
+			idx = slice(self.start[node], self.end[node])
+			self.node_sums[node] = np.sum(self.data[idx] * self.weights[idx, np.newaxis], axis = 0)
+			self.node_counts[node] = np.sum(self.weights[idx])
+
+		self.labels = np.ndarray([data.shape[0]], dtype = np.intp)
+		self.sums = None
+		self.counts = None
+		self.evaluations = 0
+
+	def build(self, data, start, end):
+		"""
+		adds the node holding perm[start:end] and its children, returns
+		the node id
+		"""
+		points = data[self.perm[start:end]]
+		lo = np.min(points, axis = 0)
+		hi = np.max(points, axis = 0)
+
+		node = len(self.start)
+		self.start.append(start)
+		self.end.append(end)
+		self.lo.append(lo.astype(np.float64))
+		self.hi.append(hi.astype(np.float64))
+		self.children.append(None)
+
+		if(end - start > self.leaf_size and np.any(lo != hi)):
+			# Split the widest dimension by its median
+			dim = np.argmax(hi.astype(np.int64) - lo)
+			mid = (end - start) // 2
+			order = np.argpartition(points[:, dim], mid)
+			self.perm[start:end] = self.perm[start:end][order]
+
+			left = self.build(data, start, start + mid)
+			right = self.build(data, start + mid, end)
+			self.children[node] = (left, right)
+
+		return node
+
+	def assign(self, c_means, clusters):
+		"""
+		same as assignment.assign, also leaves the weighted sum and count
+		of every cluster in self.sums and self.counts
+
+		Arguments:
+		c_means: numpy 2d numerical array
+		clusters: numpy 1d numerical array
+		"""
+		k = c_means.shape[0]
+		self.sums = np.zeros([k, c_means.shape[1]], dtype = np.float64)
+		self.counts = np.zeros([k], dtype = np.float64)
+
+		self.filter(0, np.arange(k), c_means)
+		clusters[self.perm] = self.labels
+
+	def filter(self, node, candidates, c_means):
+		"""
+		assigns the datapoints of node to their nearest candidate
+		"""
+		if(candidates.shape[0] > 1):
+			lower, upper = self.box_bounds(self.lo[node], self.hi[node], c_means[candidates])
+			best = np.min(upper)
+			candidates = candidates[lower <= best * (1 + BOUND_MARGIN)]
+
+		start = self.start[node]
+		end = self.end[node]
+
+		if(candidates.shape[0] == 1):
+			# Every datapoint of the node belongs to the same cluster
+			j = candidates[0]
+			self.labels[start:end] = j
+			self.sums[j] += self.node_sums[node]
+			self.counts[j] += self.node_counts[node]
+		elif(self.children[node] is None):
+			# Candidates are kept in index order so ties go to the same
+			# cluster as a full assignment
+			distances = pairwise_distances(self.data[start:end], c_means[candidates], self.distance_f, True)
+			self.evaluations += distances.size
+			nearest = np.argmin(distances, axis = 1)
+			self.labels[start:end] = candidates[nearest]
+
+			sums, counts = get_sums(self.data[start:end], nearest, candidates.shape[0], self.weights[start:end])
+			self.sums[candidates] += sums
+			self.counts[candidates] += counts
+		else:
+			for child in self.children[node]:
+				self.filter(child, candidates, c_means)
+
+if __name__ == '__main__':
+	# Benchmark against the lloyd engine on the profiler images, run from
+	# the repository root with python -m engines.kdtree [images...]
+	import sys
+	import os
+	import time
+	import cv2
+	import utils
+	from kmeans import k_means
+	from rgb_distance import rgb_distance
+	from initializers.uniform_mode_dist import uniform_mode_dist_init
+
+	utils.vlevel = 0
+	im_paths = sys.argv[1:]
+	if(len(im_paths) == 0):
+		if(not os.path.exists('profile_images')):
+			raise Exception('\'profile_images\' folder not found')
+		im_paths = [os.path.join('profile_images', file) for file in os.listdir('profile_images')]
+
+	for im_path in im_paths:
+		image = cv2.imread(im_path).reshape([-1, 3])
+		for k in [4, 16, 64]:
+			times = {}
+			results = {}
+			for engine in ['lloyd', 'kdtree']:
+				t0 = time.perf_counter()
+				results[engine] = k_means(image, k, rgb_distance, uniform_mode_dist_init, engine = engine)
+				time_profile = results[engine][3]
+
+				# Only the iterations, initialization is the same for both
+				times[engine] = time.perf_counter() - t0
+				times[engine] -= time_profile['unique_mapping'] + time_profile['init_point_selection']
+				times[engine] -= time_profile.get('kdtree_build', 0)
+
+			same = np.array_equal(results['lloyd'][1], results['kdtree'][1])
+			print('{} k={}: lloyd {:.3f}s kdtree {:.3f}s (build {:.3f}s) speedup {:.2f} same clusters {}'.format(
+				os.path.basename(im_path), k, times['lloyd'], times['kdtree'],
+				results['kdtree'][3]['kdtree_build'], times['lloyd']/times['kdtree'], same
+			))
@@ -0,0 +1,55 @@
+import numpy as np
+from assignment import assign, CHUNK_SIZE
+
+def minibatch_means(data, el_count, c_means, distance_f, batch_size = 1024, max_batches = 100, drift_tol = 0.01, seed = 0, chunk_size = CHUNK_SIZE):
+	"""
+	mini-batch k-means, moves c_means towards batches of datapoints
+	sampled with probability proportional to their count, every central
+	point has its own learning rate 1/(datapoints it has seen) so the
+	result is the running mean of the samples assigned to it
+
+	Arguments:
+	data: numpy 2d numerical array
+	el_count: numpy 1d numerical array
+	c_means: numpy 2d numerical array, updated in place
+	distance_f: function of datapoint x datapoint -> float
+	batch_size: int
+	max_batches: int
+	drift_tol: float, stop once no central point moves more than this
+	seed: int, seed of the batch sampling
+	chunk_size: int
+
+	Output:
+	n_batches: int, amount of batches used
+	"""
+	rand_state = np.random.RandomState(seed)
+	probability = el_count / np.sum(el_count, dtype = np.float64)
+	k = c_means.shape[0]
+
+	means = c_means.astype(np.float64)
+	seen = np.zeros([k], dtype = np.float64)
+	labels = np.ndarray([batch_size], dtype = np.intp)
+
+	n_batches = 0
+	while(n_batches < max_batches):
+		batch = data[rand_state.choice(data.shape[0], batch_size, p = probability)]
+		assign(batch, means.astype(c_means.dtype), labels, distance_f, chunk_size)
+		n_batches += 1
+
+		# Closed form of updating every central point once per sample
+		# with learning rate 1/seen
+		batch_count = np.bincount(labels, minlength = k)
+		hit = batch_count > 0
+		seen += batch_count
+		old_means = means.copy()
+		for j in range(data.shape[1]):
+			sums = np.bincount(labels, weights = batch[:, j], minlength = k)
+			means[hit, j] += (sums[hit] - batch_count[hit] * means[hit, j]) / seen[hit]
+
+		drift = np.sqrt(np.max(np.sum((means - old_means)**2, axis = 1)))
+		if(drift < drift_tol):
+			break
+
+	c_means[:] = means
+
+	return n_batches
@@ -0,0 +1,176 @@
+import numpy as np
+import tempfile
+import shutil
+import os
+from concurrent.futures import ProcessPoolExecutor
+from assignment import accumulate_chunk, CHUNK_SIZE
+
+# Arrays of the worker process, opened once by init_shard_worker
+worker_arrays = {}
+
+class ShardedAssigner(object):
+	"""
+	map-reduce Lloyd pass over worker processes, the datapoints, their
+	weights and their clusters live in memory-mapped files that every
+	worker opens, each worker assigns its shard and returns the partial
+	sums of its blocks, which are added by the coordinator in block
+	order so the result is exactly the one of assignment.assign_accumulate
+
+	The map step only needs the shard bounds and the central points, so
+	the process pool can be replaced by any executor whose workers see
+	the files, like nodes sharing a filesystem
+
+	data: numpy 2d numerical array
+	distance_f: function of datapoint x datapoint -> float, it has to be
+	picklable
+	weights: numpy 1d numerical array or None
+	shards: int, amount of worker processes and shards
+	chunk_size: int, shards are split on multiples of it
+	clusters_dtype: numpy dtype of the cluster ids
+	shard_dir: string, directory for the memory-mapped files, /dev/shm
+	when there is one
+	"""
+
+	def __init__(self, data, distance_f, weights = None, shards = 2, chunk_size = CHUNK_SIZE, clusters_dtype = np.uint32, shard_dir = None):
+		if(shards < 1):
+			raise ValueError('shards must be positive, got {}'.format(shards))
+
+		self.dir = shared_dir('kmeans_shards_', shard_dir)
+
+		n = data.shape[0]
+		self.data = share_array(self.dir, 'data', data)
+		self.weights = None if weights is None else share_array(self.dir, 'weights', weights)
+		self.clusters = np.memmap(
+			os.path.join(self.dir, 'clusters'), dtype = clusters_dtype,
+			mode = 'w+', shape = (n,)
+		)
+
+		# Whole blocks per shard, the block bounds are the same ones the
+		# single process pass uses
+		bounds = [(start, min(start + chunk_size, n)) for start in range(0, n, chunk_size)]
+		self.shards = [list(shard) for shard in np.array_split(np.arange(len(bounds)), shards) if len(shard) > 0]
+		self.shards = [[bounds[i] for i in shard] for shard in self.shards]
+
+		layout = {
+			'dir': self.dir,
+			'n': n,
+			'd': data.shape[1],
+			'data_dtype': data.dtype.str,
+			'weights_dtype': None if weights is None else weights.dtype.str,
+			'clusters_dtype': self.clusters.dtype.str
+		}
+		self.executor = ProcessPoolExecutor(
+			len(self.shards),
+			initializer = init_shard_worker,
+			initargs = (layout,)
+		)
+		self.distance_f = distance_f
+
+	def step(self, c_means, clusters):
+		"""
+		assigns every datapoint to its nearest central point writing the
+		cluster ids into clusters, and returns the sum and count of every
+		cluster and the sum of the squared distances
+
+		Arguments:
+		c_means: numpy 2d numerical array
+		clusters: numpy 1d numerical array
+
+		Output:
+		sums: numpy 2d float64 array with shape [k, d]
+		count: numpy 1d float64 array with shape [k]
+		sq_error: float
+		"""
+		futures = [
+			self.executor.submit(map_shard, shard, c_means, self.distance_f)
+			for shard in self.shards
+		]
+
+		# Reduce in shard and block order
+		k = c_means.shape[0]
+		sums = np.zeros([k, self.data.shape[1]], dtype = np.float64)
+		count = np.zeros([k], dtype = np.float64)
+		sq_error = 0.0
+		for future in futures:
+			for chunk_sums, chunk_count, chunk_error in future.result():
+				sums += chunk_sums
+				count += chunk_count
+				sq_error += chunk_error
+
+		clusters[:] = self.clusters
+
+		return sums, count, sq_error
+
+	def close(self):
+		"""
+		stops the workers and removes the memory-mapped files
+		"""
+		self.executor.shutdown()
+		del self.data, self.weights, self.clusters
+		shutil.rmtree(self.dir, ignore_errors = True)
+
+def shared_dir(prefix, parent = None):
+	"""
+	returns a new directory for memory-mapped arrays, under /dev/shm when
+	there is one and no parent is given
+	"""
+	if(parent is None and os.path.isdir('/dev/shm')):
+		parent = '/dev/shm'
+
+	return tempfile.mkdtemp(prefix = prefix, dir = parent)
+
+def share_array(directory, name, array):
+	"""
+	copies an array into a memory-mapped file of directory
+	"""
+	shared = np.memmap(os.path.join(directory, name), dtype = array.dtype, mode = 'w+', shape = array.shape)
+	shared[:] = array
+	shared.flush()
+
+	return shared
+
+def open_array(directory, name, dtype, shape, mode = 'r'):
+	"""
+	opens an array of directory written by share_array, usually from
+	another process
+	"""
+	return np.memmap(os.path.join(directory, name), dtype = dtype, mode = mode, shape = shape)
+
+def init_shard_worker(layout):
+	"""
+	opens the memory-mapped arrays of a ShardedAssigner in a worker
+	process
+	"""
+	directory = layout['dir']
+	n = layout['n']
+
+	worker_arrays['data'] = open_array(directory, 'data', layout['data_dtype'], (n, layout['d']))
+	if(layout['weights_dtype'] is None):
+		worker_arrays['weights'] = None
+	else:
+		worker_arrays['weights'] = open_array(directory, 'weights', layout['weights_dtype'], (n,))
+	worker_arrays['clusters'] = open_array(directory, 'clusters', layout['clusters_dtype'], (n,), 'r+')
+
+def map_shard(shard, c_means, distance_f):
+	"""
+	assigns the blocks of a shard and returns their partial sums,
+	counts and squared errors in block order
+
+	Arguments:
+	shard: list of (int, int), block bounds
+	c_means: numpy 2d numerical array
+	distance_f: function of datapoint x datapoint -> float
+
+	Output:
+	partials: list of (sums, count, sq_error)
+	"""
+	data = worker_arrays['data']
+	weights = worker_arrays['weights']
+	clusters = worker_arrays['clusters']
+
+	partials = []
+	for start, end in shard:
+		sums, count, sq_error, _ = accumulate_chunk(data, c_means, clusters, distance_f, weights, start, end)
+		partials.append((sums, count, sq_error))
+
+	return partials
@@ -1,62 +1,300 @@
-from kmeans import k_means
+from kmeans import k_means, get_uniques_inverse, ENGINES
 from rgb_distance import rgb_distance
+from lab_distance import lab_distance
 from initializers.uniform_mode_dist import uniform_mode_dist_init
-from pixel_to_hashable import pixel_to_str, str_to_pixel
-from image_diversion import ptp_idm
+from initializers.split import split_init
+from image_diversion import indexed_idm, table_idm
+from indexed_image import IndexedImage
+from palette_cache import PaletteCache, MAX_BYTES
 import numpy as np
 import argparse
+import tracemalloc
 import time
 import cv2
 import os
 import utils
 
-import resource
+# Distance used by k_means for every color space
+DISTANCES = {
+	'rgb': rgb_distance,
+	'lab': lab_distance
+}
 
-def compress_image(im_path, k, init_f = uniform_mode_dist_init):
+class StageMemory(object):
+	"""
+	peak traced memory of the stages of compress_image in MB, stored in
+	time_profile as peak_memory_<stage>. tracemalloc is started when it
+	wasn't tracing already, the peak is reset after every stage where
+	tracemalloc can do it (python 3.9) and is the running peak otherwise
+
+	enabled: bool
+	"""
+
+	def __init__(self, enabled):
+		self.enabled = enabled
+		self.started = enabled and not tracemalloc.is_tracing()
+		self.peaks = {}
+		if(self.started):
+			tracemalloc.start()
+
+	def stage(self, name):
+		"""
+		records the peak since the previous stage under name
+		"""
+		if(not self.enabled):
+			return
+
+		self.peaks['peak_memory_' + name] = tracemalloc.get_traced_memory()[1] / 2**20
+		if(hasattr(tracemalloc, 'reset_peak')):
+			tracemalloc.reset_peak()
+
+	def stop(self):
+		"""
+		stops tracemalloc if it was started here, it can be called more
+		than once
+		"""
+		if(self.started):
+			tracemalloc.stop()
+			self.started = False
+
+def compress_image(im_path, k, init_f = uniform_mode_dist_init, aid_from_table = False, indexed = False, cache = None, color_space = 'rgb', return_original = False, memory_profile = False, **kmeans_args):
 	"""
 	returns the original and compressed version of an image together
-	with time profile data
+	with time profile data, the pixels are clustered on the decoded
+	image instead of a converted copy and colors are only put in rgb
+	order for the unique colors and the palette, the unique color
+	extraction still allocates its own per pixel arrays
 
 	Arguments:
 	im_path: string
 	k: int
 	init_f: function of 2d array x 1d array x int x function -> 2d array
+	aid_from_table: bool, compute the aid on the unique colors weighted
+	by their count instead of pixel by pixel
+	indexed: bool, return the compressed image as an IndexedImage
+	cache: PaletteCache or None, reuse the k-means result of a previous
+	run with the same pixels and parameters
+	color_space: string, key of DISTANCES, 'lab' clusters in CIE Lab
+	with an euclidean distance and its mse is in Lab units
+	return_original: bool, return the decoded image, None is returned
+	in its place otherwise
+	memory_profile: bool, add the peak memory of every stage to
+	time_profile, see StageMemory
+	kmeans_args: keyword arguments for kmeans.k_means, like weighted,
+	engine or the mini-batch options
 
 	Output:
-	image: numpy 2d numerical array
-	compressed_image numpy 2d numerical array
+	image: numpy 3d uint8 array in bgr or None
+	compressed_image numpy 3d uint8 array in bgr or IndexedImage
 	mse: float
+	aid: float
 	time_profile: dict of string -> float
 	"""
-	# Read image
-	image = cv2.imread(im_path)
-	image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-	# Store original shape
-	original_shape = image.shape
-	# Reshape into a numpy 2d array
-	image = image.reshape([image.shape[0] * image.shape[1], 3])
-
-	# Run k-means
-	t0 = time.time()
-	c_means, clusters, mse, time_profile = k_means(image, k, rgb_distance, init_f, pixel_to_str, str_to_pixel)
-	t1 = time.time()
-	time_profile['k_means'] = t1 - t0
-
-	# Create compressed image
-	compressed_image = np.zeros(image.shape, dtype = np.uint8)
-	for i in range(compressed_image.shape[0]):
-		compressed_image[i] = c_means[clusters[i]].astype(np.uint8)
-
-	# Return to original shape
-	image = image.reshape(original_shape).astype(np.uint8)
-	compressed_image = compressed_image.reshape(original_shape).astype(np.uint8)
-	image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
-	compressed_image = cv2.cvtColor(compressed_image, cv2.COLOR_RGB2BGR)
-
-	aid = ptp_idm(image, compressed_image)
+	memory = StageMemory(memory_profile)
+	# Tracing is stopped even when a stage raises
+	try:
+		image = read_image(im_path)
+		# Pixels as rows, a view of the decoded image
+		pixels = image.reshape([-1, 3])
+		distance_f = DISTANCES[color_space]
+		memory.stage('decode')
+
+		# Look for a previous run of the same pixels and parameters
+		entry = None
+		if(cache is not None):
+			t0 = time.perf_counter()
+			key = cache.key(pixels, k, init_f, distance_f, kmeans_args)
+			entry = cache.get(key)
+			cache_time = time.perf_counter() - t0
+
+		# Unique colors in rgb order from a reversed view of the bgr pixels,
+		# only needed on a hit for the aid
+		uniques = None
+		if(entry is None or aid_from_table):
+			t0 = time.perf_counter()
+			uniques = get_uniques_inverse(pixels[:, ::-1])
+			unique_time = time.perf_counter() - t0
+			memory.stage('unique_mapping')
+
+		if(entry is not None):
+			c_means, clusters, mse = entry
+			time_profile = {'k_means': 0.0}
+		else:
+			# Run k-means
+			t0 = time.time()
+			c_means, clusters, mse, time_profile = k_means(pixels, k, distance_f, init_f, uniques = uniques, **kmeans_args)
+			t1 = time.time()
+			time_profile['k_means'] = t1 - t0
+			memory.stage('k_means')
+
+			# Runs stopped by their budget or their callback are not final
+			# results
+			stopped = 'budget_stop' in time_profile or 'cancelled' in time_profile
+			if(cache is not None and not stopped):
+				t0 = time.perf_counter()
+				cache.put(key, c_means, clusters, mse)
+				cache_time += time.perf_counter() - t0
+
+		if(cache is not None):
+			time_profile['cache_lookup'] = cache_time
+			time_profile['cache_hit'] = float(entry is not None)
+			time_profile.update(cache.stats())
+
+		if(uniques is not None):
+			time_profile['unique_mapping'] = unique_time
+
+		compressed_image = build_indexed(c_means, clusters, image.shape)
+		if(aid_from_table):
+			aid = get_table_aid(uniques, c_means, clusters)
+		else:
+			# ptp_idm is measured on the bgr images
+			aid = indexed_idm(image, compressed_image.indices, compressed_image.palette[:, ::-1])
+
+		if(not indexed):
+			compressed_image = compressed_image.to_bgr()
+		memory.stage('output')
+		time_profile.update(memory.peaks)
+	finally:
+		memory.stop()
+
+	if(not return_original):
+		image = None
 
 	return image, compressed_image, mse, aid, time_profile
 
+def compress_image_sweep(im_path, ks, init_f = uniform_mode_dist_init, aid_from_table = False, indexed = False, color_space = 'rgb', **kmeans_args):
+	"""
+	compresses an image with every amount of colors in ks, the image is
+	read and its unique colors extracted only once, the smallest k starts
+	from init_f and every larger one from the converged means of the
+	previous one with its worst clusters split
+
+	Arguments:
+	im_path: string
+	ks: list of int
+	init_f: function of 2d array x 1d array x int x function -> 2d array
+	aid_from_table: bool, compute the aid on the unique colors weighted
+	by their count instead of pixel by pixel
+	indexed: bool, return the compressed images as IndexedImage
+	color_space: string, key of DISTANCES
+	kmeans_args: keyword arguments for kmeans.k_means
+
+	Output:
+	image: numpy 3d uint8 array in bgr
+	results: dict of int -> (c_means, compressed_image, mse, aid, time_profile)
+	"""
+	image = read_image(im_path)
+	pixels = image.reshape([-1, 3])
+	distance_f = DISTANCES[color_space]
+
+	t0 = time.perf_counter()
+	uniques = get_uniques_inverse(pixels[:, ::-1])
+	t1 = time.perf_counter()
+	unique_time = t1 - t0
+
+	results = {}
+	c_means = None
+	for k in sorted(set(ks)):
+		# Warm start from the previous palette
+		t0 = time.perf_counter()
+		if(c_means is not None):
+			init_means = split_init(uniques[0], uniques[1], c_means, k, rgb_distance, kmeans_args.get('weighted', False))
+		else:
+			init_means = None
+		t1 = time.perf_counter()
+
+		t2 = time.time()
+		c_means, clusters, mse, time_profile = k_means(
+			pixels, k, distance_f, init_f,
+			uniques = uniques, init_means = init_means, **kmeans_args
+		)
+		t3 = time.time()
+		time_profile['k_means'] = t3 - t2
+
+		# The extraction is only paid once, by the first k
+		time_profile['unique_mapping'] = unique_time
+		unique_time = 0.0
+		if(init_means is not None):
+			time_profile['init_point_selection'] = t1 - t0
+
+		compressed_image = build_indexed(c_means, clusters, image.shape)
+		if(aid_from_table):
+			aid = get_table_aid(uniques, c_means, clusters)
+		else:
+			aid = indexed_idm(image, compressed_image.indices, compressed_image.palette[:, ::-1])
+
+		if(not indexed):
+			compressed_image = compressed_image.to_bgr()
+		results[k] = (c_means, compressed_image, mse, aid, time_profile)
+
+	return image, results
+
+def get_table_aid(uniques, c_means, clusters):
+	"""
+	returns the same aid ptp_idm gives for the original and compressed
+	images, computed on the unique colors weighted by their count
+
+	Arguments:
+	uniques: tuple of kmeans.get_uniques_inverse output
+	c_means: numpy 2d numerical array
+	clusters: numpy 1d numerical array, cluster of every pixel
+
+	Output:
+	aid: float
+	"""
+	unique_datap, el_count, inverse = uniques
+
+	# Every pixel of a unique color is in the same cluster
+	unique_clusters = np.ndarray([unique_datap.shape[0]], dtype = clusters.dtype)
+	unique_clusters[inverse] = clusters
+	compressed_colors = c_means.astype(np.uint8)[unique_clusters]
+
+	# ptp_idm is measured on the bgr images
+	return table_idm(unique_datap[:, ::-1], compressed_colors[:, ::-1], el_count)
+
+def print_iteration(record):
+	"""
+	k_means callback printing the progress of every iteration
+	"""
+	print('iteration {}: MSE {:.3f}, shift {:.3f}, {} reassigned, assign {:.4f}s, update {:.4f}s'.format(
+		record['iteration'], record['mse'], record['center_shift'], record['reassigned'],
+		record['assign_time'] + record['mse_time'], record['update_time']
+	))
+
+def read_image(im_path):
+	"""
+	returns an image as decoded, in bgr
+
+	Arguments:
+	im_path: string
+
+	Output:
+	image: numpy 3d uint8 array
+	"""
+	image = cv2.imread(im_path)
+	if(image is None):
+		raise ValueError('Could not read image {}'.format(im_path))
+
+	return image
+
+def build_indexed(c_means, clusters, original_shape):
+	"""
+	returns the compressed image as the cluster of every pixel and the
+	means as palette
+
+	Arguments:
+	c_means: numpy 2d numerical array
+	clusters: numpy 1d numerical array
+	original_shape: tuple of int
+
+	Output:
+	compressed_image: IndexedImage
+	"""
+	palette = c_means.astype(np.uint8)
+	indices = clusters.reshape(original_shape[:2])
+
+	return IndexedImage(indices, palette)
+
 if __name__ == '__main__':
 
 	# Script arguments
@@ -77,17 +315,139 @@ if __name__ == '__main__':
 		nargs = '+',
 		help = 'Number of colors'
 	)
+	ap.add_argument(
+		'-s',
+		'--sweep',
+		action = 'store_true',
+		help = 'Start every amount of colors from the previous one'
+	)
+	ap.add_argument(
+		'--table-aid',
+		action = 'store_true',
+		help = 'Compute the aid on the unique colors instead of every pixel'
+	)
+	ap.add_argument(
+		'--indexed',
+		action = 'store_true',
+		help = 'Write palette pngs'
+	)
 	ap.add_argument(
 		'-t',
 		'--time',
 		action = 'store_true',
 		help = 'Print time profile'
 	)
+	ap.add_argument(
+		'-m',
+		'--memory',
+		action = 'store_true',
+		help = 'Print the peak memory of every stage'
+	)
 	ap.add_argument(
 		'-mse',
 		action = 'store_true',
 		help = 'Print MSE'
 	)
+	ap.add_argument(
+		'-w',
+		'--weighted',
+		action = 'store_true',
+		help = 'Weight every color by its pixel count'
+	)
+	ap.add_argument(
+		'-e',
+		'--engine',
+		default = 'lloyd',
+		choices = ENGINES,
+		help = 'k-means engine'
+	)
+	ap.add_argument(
+		'--color-space',
+		default = 'rgb',
+		choices = sorted(DISTANCES.keys()),
+		help = 'Color space the colors are clustered in'
+	)
+	ap.add_argument(
+		'--batch-size',
+		type = int,
+		default = 1024,
+		help = 'Colors per mini-batch'
+	)
+	ap.add_argument(
+		'--max-batches',
+		type = int,
+		default = 100,
+		help = 'Maximum amount of mini-batches'
+	)
+	ap.add_argument(
+		'--drift-tol',
+		type = float,
+		default = 0.01,
+		help = 'Stop the mini-batches once no color moves more than this'
+	)
+	ap.add_argument(
+		'--seed',
+		type = int,
+		default = 0,
+		help = 'Seed of the mini-batch sampling'
+	)
+	ap.add_argument(
+		'-j',
+		'--workers',
+		type = int,
+		default = 1,
+		help = 'Threads used for the k-means assignment, processes of the sharded engine'
+	)
+	ap.add_argument(
+		'--max-iter',
+		type = int,
+		default = None,
+		help = 'Maximum amount of k-means iterations'
+	)
+	ap.add_argument(
+		'--time-budget',
+		type = float,
+		default = None,
+		help = 'Stop k-means after this many seconds with the best means so far'
+	)
+	ap.add_argument(
+		'--checkpoint',
+		default = None,
+		help = 'File where the k-means state is saved while it runs'
+	)
+	ap.add_argument(
+		'--checkpoint-iters',
+		type = int,
+		default = None,
+		help = 'Save the state every this many iterations'
+	)
+	ap.add_argument(
+		'--checkpoint-seconds',
+		type = float,
+		default = None,
+		help = 'Save the state every this many seconds'
+	)
+	ap.add_argument(
+		'--resume',
+		action = 'store_true',
+		help = 'Continue from the checkpoint when there is one'
+	)
+	ap.add_argument(
+		'--progress',
+		action = 'store_true',
+		help = 'Print every k-means iteration'
+	)
+	ap.add_argument(
+		'--cache',
+		default = None,
+		help = 'Directory where k-means results are cached across runs'
+	)
+	ap.add_argument(
+		'--cache-size',
+		type = int,
+		default = MAX_BYTES // 2**20,
+		help = 'Maximum size of the cache in MB'
+	)
 	ap.add_argument(
 		'-v',
 		'--verbosity',
@@ -97,6 +457,19 @@ if __name__ == '__main__':
 	)
 	args = ap.parse_args()
 
+	# The sweep runs every k in one call, without per k checkpoints,
+	# cache lookups or stage memory
+	if(args.sweep):
+		unsupported = []
+		if(args.checkpoint is not None):
+			unsupported.append('--checkpoint')
+		if(args.cache is not None):
+			unsupported.append('--cache')
+		if(args.memory):
+			unsupported.append('--memory')
+		if(unsupported):
+			ap.error('--sweep cannot be combined with {}'.format(', '.join(unsupported)))
+
 	# Define constants
 	IM_PATH = args.image
 	K = args.colors
@@ -106,28 +479,85 @@ if __name__ == '__main__':
 	# Image data
 	im_name = IM_PATH.split('/')[-1].split('.')[:-1][0]
 
+	kmeans_args = {
+		'weighted': args.weighted,
+		'engine': args.engine,
+		'batch_size': args.batch_size,
+		'max_batches': args.max_batches,
+		'drift_tol': args.drift_tol,
+		'seed': args.seed,
+		'workers': args.workers,
+		'max_iter': args.max_iter,
+		'time_budget': args.time_budget,
+		'checkpoint_iters': args.checkpoint_iters,
+		'checkpoint_seconds': args.checkpoint_seconds,
+		'resume': args.resume
+	}
+
+	if(args.progress):
+		kmeans_args['callback'] = print_iteration
+
+	cache = None
+	if(args.cache is not None):
+		cache = PaletteCache(args.cache, args.cache_size * 2**20)
+
 	print('Compressing', im_name)
+	if(args.sweep):
+		image, sweep_results = compress_image_sweep(
+			IM_PATH, K,
+			aid_from_table = args.table_aid,
+			indexed = args.indexed,
+			color_space = args.color_space,
+			**kmeans_args
+		)
+		K = sorted(sweep_results.keys())
+
 	for k in K:
 		print(k, 'colors')
-		image, compressed_image, mse, _, time_profile = compress_image(IM_PATH, k)
+		# One checkpoint file per amount of colors
+		if(args.checkpoint is not None):
+			kmeans_args['checkpoint'] = '{}_{}colors.npz'.format(os.path.splitext(args.checkpoint)[0], k)
+		# The original is only asked for while it hasn't been written
+		original_path = './compressed/{}_original.png'.format(im_name)
+		write_original = not os.path.exists(original_path)
+		if(args.sweep):
+			_, compressed_image, mse, _, time_profile = sweep_results[k]
+		else:
+			image, compressed_image, mse, _, time_profile = compress_image(
+				IM_PATH, k,
+				aid_from_table = args.table_aid,
+				indexed = args.indexed,
+				cache = cache,
+				color_space = args.color_space,
+				return_original = write_original,
+				memory_profile = args.memory,
+				**kmeans_args
+			)
 
 		# Store original and resulting image in png format
 		if(not os.path.isdir('./compressed')):
 			os.mkdir('./compressed')
 
-		if(not os.path.exists('./compressed/{}_original.png'.format(im_name))):
-			cv2.imwrite('./compressed/{}_original.png'.format(im_name), image)
-		cv2.imwrite('./compressed/{}_{}colors.png'.format(im_name, k), compressed_image)
+		if(write_original):
+			cv2.imwrite(original_path, image)
+		if(args.indexed):
+			compressed_image.write_png('./compressed/{}_{}colors.png'.format(im_name, k))
+		else:
+			cv2.imwrite('./compressed/{}_{}colors.png'.format(im_name, k), compressed_image)
 
 		if(args.time):
 			print('Time profile')
 			for metric, value in time_profile.items():
 				print('{}: {}'.format(metric, value))
 
+		if(args.memory and not args.time):
+			print('Peak memory')
+			for metric, value in time_profile.items():
+				if(metric.startswith('peak_memory_')):
+					print('{}: {} MB'.format(metric, value))
+
 		if(args.mse):
 			print('MSE:', mse)
 
-	print('memory:', resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1000, 'MB')
-
 
 
@@ -2,15 +2,22 @@ import numpy as np
 from rgb_distance import rgb_distance
 import cv2
 
-def ptp_idm(im1, im2):
+# Amount of pixels whose distances are computed at once
+BLOCK_SIZE = 65536
+
+def ptp_idm(im1, im2, block_size = BLOCK_SIZE):
 	"""
 	Image Diversion Meassurement: a way to meassure the diversion
 	between two images by meassuring the rgb distance of both pixel
 	by pixel and reducing to a numerical value
 
+	Pixels are processed in blocks of block_size and only the sum of
+	their distances is kept
+
 	Arguments:
 	im1: numpy 3d numerical array
 	im2: numpy 3d numerical array
+	block_size: int
 
 	Output:
 	idm: float
@@ -22,16 +29,69 @@ def ptp_idm(im1, im2):
 		error_msg += '{} and {}'
 		raise ValueError(error_msg.format(im1.shape, im2.shape))
 
-	# Container for pixel distances
-	distances = np.ndarray(im1.shape, dtype = np.float32)
-
-	# Calculate distances for every pixel
-	for i in range(distances.shape[0]):
-		for j in range(distances.shape[1]):
-			distances[i][j] = rgb_distance(im1[i][j], im2[i][j])
+	# Pixels as rows, no copy for contiguous images
+	pixels1 = im1.reshape([-1, im1.shape[-1]])
+	pixels2 = im2.reshape([-1, im2.shape[-1]])
+	n = pixels1.shape[0]
 
 	# Calculate the Image Diversion Measurement	by adding distances
-	#idm = np.sum(distances)
-	idm = np.mean(distances)
+	total = 0.0
+	for start in range(0, n, block_size):
+		end = min(start + block_size, n)
+		distances = rgb_distance(pixels1[start:end], pixels2[start:end])
+		total += np.sum(distances, dtype = np.float64)
+
+	idm = total/n
 
 	return idm
+
+def table_idm(colors1, colors2, count):
+	"""
+	Image Diversion Meassurement computed on a table of colors instead
+	of pixel by pixel, colors2[i] is the color that replaces colors1[i]
+	in count[i] pixels
+
+	Arguments:
+	colors1: numpy 2d numerical array
+	colors2: numpy 2d numerical array
+	count: numpy 1d numerical array
+
+	Output:
+	idm: float
+	"""
+	distances = rgb_distance(colors1, colors2).astype(np.float64)
+	idm = np.sum(distances * count)/np.sum(count, dtype = np.float64)
+
+	return idm
+
+def indexed_idm(im, indices, palette, block_size = BLOCK_SIZE):
+	"""
+	same as ptp_idm(im, palette[indices]) without building the second
+	image, the palette is gathered one block at a time
+
+	Arguments:
+	im: numpy 3d numerical array
+	indices: numpy 2d numerical array with the shape of im without its
+	channels
+	palette: numpy 2d numerical array in the channel order of im
+	block_size: int
+
+	Output:
+	idm: float
+	"""
+	if(im.shape[:-1] != indices.shape):
+		error_msg = 'Image and indices must have the same dimensions and are'
+		error_msg += ' {} and {}'
+		raise ValueError(error_msg.format(im.shape, indices.shape))
+
+	pixels = im.reshape([-1, im.shape[-1]])
+	indices = indices.reshape([-1])
+	n = pixels.shape[0]
+
+	total = 0.0
+	for start in range(0, n, block_size):
+		end = min(start + block_size, n)
+		distances = rgb_distance(pixels[start:end], palette[indices[start:end]])
+		total += np.sum(distances, dtype = np.float64)
+
+	return total/n
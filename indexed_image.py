@@ -0,0 +1,106 @@
+import numpy as np
+import struct
+import zlib
+import cv2
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+class IndexedImage(object):
+	"""
+	compressed image kept as the palette index of every pixel together
+	with the palette, it is only expanded to a full color image when
+	asked to
+
+	indices: numpy 2d uint8/uint16 array with shape [height, width]
+	palette: numpy 2d uint8 array with shape [k, 3] in rgb
+	"""
+
+	def __init__(self, indices, palette):
+		self.indices = indices
+		self.palette = palette
+
+	@property
+	def shape(self):
+		return self.indices.shape + (self.palette.shape[1],)
+
+	def to_rgb(self):
+		"""
+		returns the image in rgb with a single palette gather
+		"""
+		return self.palette[self.indices]
+
+	def to_bgr(self):
+		"""
+		returns the image in bgr, the palette is reversed instead of
+		the image
+		"""
+		return np.ascontiguousarray(self.palette[:, ::-1])[self.indices]
+
+	def write_png(self, path, compression = 6):
+		"""
+		writes the image as a palette png, images with more than 256
+		colors are written in full color
+
+		Arguments:
+		path: string
+		compression: int, zlib level
+		"""
+		if(self.palette.shape[0] > 256):
+			cv2.imwrite(path, self.to_bgr())
+		else:
+			write_indexed_png(path, self.indices, self.palette, compression)
+
+def write_indexed_png(path, indices, palette, compression = 6):
+	"""
+	writes a palette png using the smallest bit depth that fits the
+	palette
+
+	Arguments:
+	path: string
+	indices: numpy 2d numerical array with shape [height, width]
+	palette: numpy 2d uint8 array with shape [k, 3] in rgb, k <= 256
+	compression: int, zlib level
+	"""
+	height, width = indices.shape
+	k = palette.shape[0]
+	if(k > 256):
+		raise ValueError('A palette png holds up to 256 colors, got {}'.format(k))
+
+	depth = 8
+	for bits in [1, 2, 4]:
+		if(k <= 2**bits):
+			depth = bits
+			break
+
+	# Pack the pixels of every row into bytes, first pixel in the
+	# highest bits
+	rows = indices.astype(np.uint8)
+	per_byte = 8 // depth
+	if(per_byte > 1):
+		padded_width = -(-width // per_byte) * per_byte
+		padded = np.zeros([height, padded_width], dtype = np.uint8)
+		padded[:, :width] = rows
+		padded = padded.reshape([height, padded_width // per_byte, per_byte])
+		rows = np.zeros(padded.shape[:2], dtype = np.uint8)
+		for j in range(per_byte):
+			rows |= padded[:, :, j] << (8 - depth*(j + 1))
+
+	# Every row starts with its filter type, 0 is none
+	raw = np.zeros([height, rows.shape[1] + 1], dtype = np.uint8)
+	raw[:, 1:] = rows
+
+	ihdr = struct.pack('>IIBBBBB', width, height, depth, 3, 0, 0, 0)
+	with open(path, 'wb') as f:
+		f.write(PNG_SIGNATURE)
+		f.write(png_chunk(b'IHDR', ihdr))
+		f.write(png_chunk(b'PLTE', palette.astype(np.uint8).tobytes()))
+		f.write(png_chunk(b'IDAT', zlib.compress(raw.tobytes(), compression)))
+		f.write(png_chunk(b'IEND', b''))
+
+def png_chunk(tag, data):
+	"""
+	returns a png chunk: length, tag, data and crc
+	"""
+	crc = zlib.crc32(tag + data) & 0xFFFFFFFF
+
+	return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', crc)
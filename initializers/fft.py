@@ -1,68 +1,77 @@
 import numpy as np
+from assignment import pairwise_distances
 
-def deterministic_fft(unique_dpts, data_count, n, distance_f):
+def deterministic_fft(unique_dpts, data_count, n, distance_f, criterion = 'sum'):
 	"""
 	deterministic Farthest First Traversal implementation with n points
 	using mode as starting point
 	
+	The distance of every point to the traversed ones is kept in a
+	running array updated once per new point, traversed points are
+	masked out instead of deleted
+	
 	Arguments:
 	data: numpy 2d numerical array
 	n: int
 	distance_f: function of datapoint x datapoint -> float
+	criterion: string, 'sum' picks the point with the largest sum of
+	distances to the traversed points, 'min' the one with the largest
+	distance to its nearest traversed point
 	
 	Output:
 	n_traversed: numpy 2d numerical array
 	"""
+	if(criterion not in ['sum', 'min']):
+		raise ValueError('Unknown traversal criterion {}'.format(criterion))
+	
 	# Create n_traversed array
 	n_traversed = np.ndarray([n, unique_dpts.shape[1]], dtype = unique_dpts.dtype)
 	
 	# Select mode as the starting point
-	# Also extract array with unique datapoints
 	start_p = get_mode(unique_dpts, data_count)
+	idx = np.flatnonzero(np.all(unique_dpts == start_p, axis = 1))[0]
 	
-	# Add startng point to traversed list and remove from datapoints
-	idx = np.where(np.all(unique_dpts == start_p, axis = 1))
-	n_traversed[0] = unique_dpts[idx]
-	unique_dpts = np.delete(unique_dpts, idx, axis = 0)
+	# Distance of every point to the traversed ones
+	if(criterion == 'sum'):
+		traversal_dis = np.zeros([unique_dpts.shape[0]], dtype = np.float32)
+	else:
+		traversal_dis = np.full([unique_dpts.shape[0]], np.inf, dtype = np.float32)
+	traversed = np.zeros([unique_dpts.shape[0]], dtype = bool)
 	
 	# Find rest of the data points
-	for i in range(1, n):
-		max_dis = float('-inf')
-		max_dis_idx = -1
+	for i in range(n):
+		# Add point to traversed list and mask it out
+		n_traversed[i] = unique_dpts[idx]
+		traversed[idx] = True
+		if(i == n - 1):
+			break
 		
-		# Find point with max distance to the already traversed points
-		for k in range(0, unique_dpts.shape[0]):
-			k_dis = 0
-			for u in range(0, i):
-				k_dis += distance_f(unique_dpts[k], n_traversed[u])
-				
-			if(k_dis > max_dis):
-				max_dis = k_dis
-				max_dis_idx = k
-				
-		n_traversed[i] = unique_dpts[max_dis_idx]
-		unique_dpts = np.delete(unique_dpts, max_dis_idx, axis = 0)
+		distances = pairwise_distances(unique_dpts, n_traversed[i:i+1], distance_f)[:, 0]
+		if(criterion == 'sum'):
+			traversal_dis += distances
+		else:
+			np.minimum(traversal_dis, distances, out = traversal_dis)
+		
+		# Point with max distance to the already traversed points, the
+		# first one on ties
+		candidates_dis = np.where(traversed, -np.inf, traversal_dis)
+		idx = np.argmax(candidates_dis)
 	
 	return n_traversed
 	
 def get_mode(unique_data, data_count):
 	"""
-	returns mode row from data array and a list with unique elements
+	returns mode row from the unique datapoints, the first one with the
+	highest count
 	
 	Arguments:
-	data: numpy 2d numerical array
+	unique_data: numpy 2d numerical array
+	data_count: numpy 1d numerical array
 	
 	Output:
 	mode: numpy 1d numerical array
-	unique_elems: numpy 2d numerical array
 	"""
-	max_count = 0
-	mode = None
-	for i in range(unique_data.shape[0]):
-		if(data_count[i] > max_count):
-			mode = unique_data[i]
-	
-	return mode
+	return unique_data[np.argmax(data_count)]
 
 if __name__ == '__main__':	
 	def euc_distance(p1, p2):
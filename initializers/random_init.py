@@ -1,5 +1,21 @@
 import numpy as np
 
-def random_init(unique_datap, el_count, k, distance_f):
-	
-	return (unique_datap[np.random.choice(unique_datap.shape[0], k, replace = False)])
+def random_init(unique_datap, el_count, k, distance_f, rand_state = None):
+	"""
+	returns k different unique datapoints chosen at random
+
+	Arguments:
+	unique_datap: numpy 2d numerical array
+	el_count: numpy 1d numerical array
+	k: int
+	distance_f: function of datapoint x datapoint -> float
+	rand_state: numpy RandomState, None draws from the global np.random
+	state
+
+	Output:
+	c_means: numpy 2d numerical array
+	"""
+	if(rand_state is None):
+		rand_state = np.random
+
+	return (unique_datap[rand_state.choice(unique_datap.shape[0], k, replace = False)])
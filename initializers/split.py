@@ -0,0 +1,63 @@
+import numpy as np
+from assignment import assign
+
+def split_init(unique_dpts, el_count, c_means, n, distance_f, weighted = True):
+	"""
+	Split Initialization
+	grows an already converged set of central points to n points by
+	repeatedly splitting the cluster with the highest squared error,
+	the new point is the member of that cluster which is the furthest
+	from its central point, once every point is taken the worst central
+	point is repeated, the errors are weighted by el_count only when
+	weighted, like the k-means run they warm start
+
+	Arguments:
+	unique_dpts: numpy 2d numerical array
+	el_count: numpy 1d numerical array
+	c_means: numpy 2d numerical array
+	n: int
+	distance_f: function of datapoint x datapoint -> float
+	weighted: bool
+
+	Output:
+	init_points: numpy 2d numerical array
+	"""
+	k = c_means.shape[0]
+	if(n < k):
+		raise ValueError('Cannot split {} central points into {}'.format(k, n))
+
+	init_points = np.ndarray([n, unique_dpts.shape[1]], dtype = c_means.dtype)
+	init_points[:k] = c_means
+
+	# Cluster of every point, its distance to it and the error of
+	# every cluster
+	clusters = np.ndarray([unique_dpts.shape[0]], dtype = np.intp)
+	assign(unique_dpts, c_means, clusters, distance_f)
+	distances = distance_f(unique_dpts, c_means[clusters]).astype(np.float64)
+	if(weighted):
+		errors = np.bincount(clusters, weights = el_count * distances**2, minlength = k)
+	else:
+		errors = np.bincount(clusters, weights = distances**2, minlength = k)
+
+	taken = np.zeros([unique_dpts.shape[0]], dtype = bool)
+	for i in range(k, n):
+		j = np.argmax(errors)
+
+		# Furthest member of the cluster not taken yet
+		candidates = np.flatnonzero((clusters == j) & ~taken)
+		if(candidates.shape[0] == 0):
+			candidates = np.flatnonzero(~taken)
+
+		# With fewer points than n the worst central point is repeated,
+		# as the other initializers do
+		if(candidates.shape[0] == 0):
+			init_points[i] = init_points[j]
+		else:
+			far = candidates[np.argmax(distances[candidates])]
+			init_points[i] = unique_dpts[far]
+			taken[far] = True
+
+		# Assume the split halves the error of the cluster
+		errors[j] /= 2
+
+	return init_points
@@ -1,4 +1,5 @@
 import numpy as np
+from assignment import pairwise_distances
 from .fft import get_mode
 
 def uniform_mode_dist_init(unique_dpts, el_count, n, distance_f):
@@ -23,24 +24,14 @@ def uniform_mode_dist_init(unique_dpts, el_count, n, distance_f):
 		shape = [n, unique_dpts.shape[1]],
 		dtype = unique_dpts.dtype
 	)
-	distances = np.ndarray(
-		shape = [unique_dpts.shape[0]],
-		dtype = np.float32
-	)
 
 	# Get the mode and make it first init point
 	mode = get_mode(unique_dpts, el_count)
 	init_points[0] = mode
 
-	# Calculate distances and get min and max distances
-	min_dis = float('inf')
-	max_dis = float('-inf')
-	for i in range(distances.shape[0]):
-		dist = distance_f(mode, unique_dpts[i])
-		distances[i] = dist
-
-		if(dist > max_dis):
-			max_dis = dist
+	# Calculate distances and get max distance
+	distances = pairwise_distances(unique_dpts, mode[np.newaxis], distance_f)[:, 0]
+	max_dis = np.max(distances)
 
 	# Stablish distance within points (tresh)
 	# Note that we are multiplying max_dis by 0.8 to get 80% of the
@@ -55,20 +46,21 @@ def uniform_mode_dist_init(unique_dpts, el_count, n, distance_f):
 	unique_dpts = unique_dpts[sort_idxs]
 	distances = distances[sort_idxs]
 
-	# In case the loop ends and n points weren't found
-	# diminish the treshold and start again
+	# In case n points weren't found diminish the treshold and start
+	# again
 	j = 1
 	while( j != n ):
 		j = 1
 		last = 0
-		# Search points that are evenly spaced
-		for i in range(0, distances.shape[0]):
-			if(j == n):
+		# Search points that are evenly spaced, the next one is the
+		# first point at least tresh further than the last one
+		while(j != n):
+			i = np.searchsorted(distances, last + tresh, side = 'left')
+			if(i == distances.shape[0]):
 				break
-			elif(distances[i] >= last + tresh):
-				last = distances[i]
-				init_points[j] = unique_dpts[i]
-				j += 1
+			last = distances[i]
+			init_points[j] = unique_dpts[i]
+			j += 1
 
 		tresh = tresh*0.8
 
@@ -77,20 +69,13 @@ def uniform_mode_dist_init(unique_dpts, el_count, n, distance_f):
 
 def get_mode_idx(unique_data, data_count):
 	"""
-	returns mode row from data array and a list with unique elements
+	returns the index of the mode row from the unique datapoints
 
 	Arguments:
-	data: numpy 2d numerical array
+	unique_data: numpy 2d numerical array
+	data_count: numpy 1d numerical array
 
 	Output:
-	mode: numpy 1d numerical array
-	unique_elems: numpy 2d numerical array
+	mode_idx: int
 	"""
-	max_count = 0
-	mode_idx = -1
-	for i in range(unique_data.shape[0]):
-		if(data_count[i] > max_count):
-			mode_idx = i
-			max_count = data_count[i]
-
-	return mode_idx
+	return np.argmax(data_count)
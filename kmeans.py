@@ -1,21 +1,80 @@
 import numpy as np
 np.seterr(all = 'raise')
+import hashlib
 import time
+import os
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from utils import vprint
+from utils import vprint, function_name
+from assignment import assign, assign_accumulate, get_sums, squared_error, CHUNK_SIZE
+from pixel_to_hashable import pixels_to_int, ints_to_pixels
+from engines.hamerly import HamerlyAssigner
+from engines.minibatch import minibatch_means
+from engines.kdtree import KdTreeAssigner
+from engines.sharded import ShardedAssigner
 
 EPS_F32 = np.finfo(np.float32).eps
 
-def k_means(data, k, distance_f, init_f, datap_to_hashable, hashable_to_datap):
+# Values of the engine argument of k_means
+ENGINES = ('lloyd', 'hamerly', 'minibatch', 'kdtree', 'sharded')
+
+def k_means(data, k, distance_f, init_f, datap_to_hashable = None, hashable_to_datap = None, chunk_size = CHUNK_SIZE, weighted = False, engine = 'lloyd', batch_size = 1024, max_batches = 100, drift_tol = 0.01, seed = 0, workers = 1, uniques = None, init_means = None, init_clusters = None, max_iter = None, time_budget = None, checkpoint = None, checkpoint_iters = None, checkpoint_seconds = None, resume = False, trace = None, callback = None):
 	"""
 	k-means implementation
 	
 	Arguments:
 	data: numpy 2d numerical array
 	k: int
-	distance_f: function of datapoint x datapoint -> float
+	distance_f: function of datapoint x datapoint -> float, when it has
+	to_space and from_space attributes the unique datapoints are
+	converted with to_space, clustered in that space and the means are
+	converted back with from_space, the mse stays in that space
 	init_f: function of 2d array x 1d array x int x function -> 2d array
+	datap_to_hashable: function of datapoint -> hashable, when None
+	unique pixels are extracted by packing them into integers
+	hashable_to_datap: function of hashable -> datapoint
+	chunk_size: int, amount of datapoints assigned at once
+	weighted: bool, weight every unique datapoint by its count so the
+	means and mse are the ones of the whole dataset
+	engine: string, 'lloyd' computes every distance on every iteration,
+	'hamerly' skips the ones whose outcome is already known,
+	'minibatch' updates the means with samples of the datapoints and
+	assigns all of them once at the end, 'kdtree' assigns whole
+	regions of a kd-tree over the datapoints at once, 'sharded' splits
+	the lloyd assignment over worker processes with the same result
+	batch_size: int, datapoints per mini-batch
+	max_batches: int, maximum amount of mini-batches
+	drift_tol: float, stop the mini-batches once no mean moves more
+	than this
+	seed: int, seed of the mini-batch sampling
+	workers: int, threads running the assignment of the lloyd and
+	minibatch engines, processes of the sharded engine
+	uniques: tuple of get_uniques_inverse output for data, skips the
+	unique extraction when it was already done
+	init_means: numpy 2d numerical array, starting points used instead
+	of calling init_f
+	init_clusters: numpy 1d numerical array, known cluster of every
+	unique datapoint for init_means or -1, only the -1 ones are assigned
+	on the initial clusterization, ignored by the minibatch engine
+	max_iter: int, stop after this many iterations of the loop
+	time_budget: float, stop the loop once k_means has run this many
+	seconds, a stopped run returns the means and clusters of its last
+	assignment and sets time_profile['budget_stop']
+	checkpoint: string, file where the state of the loop is saved
+	checkpoint_iters: int, save the state every this many iterations
+	checkpoint_seconds: float, save the state every this many seconds,
+	with neither of them it is saved on every iteration
+	resume: bool, continue from checkpoint when the file exists, the
+	result is the same an uninterrupted run gives, a checkpoint of
+	other data or parameters raises ValueError, the minibatch engine has
+	no loop to resume and raises ValueError
+	trace: list, when given a record of every iteration is appended to
+	it, see report_iteration
+	callback: function of dict -> bool, called with the record of every
+	iteration, returning True stops the run and sets
+	time_profile['cancelled'], records are only built when trace or
+	callback are given
 	
 	Output:
 	c_means: numpy 2d numerical array
@@ -32,16 +91,17 @@ def k_means(data, k, distance_f, init_f, datap_to_hashable, hashable_to_datap):
 		error_msg += 'Clusters: {}\nTotal datapoints: {}.'
 		raise ValueError(error_msg.format(k, data.shape[0]))
 	
+	if(engine not in ENGINES):
+		raise ValueError('Unknown k-means engine {}, expected one of {}'.format(engine, ', '.join(ENGINES)))
+	if(resume and engine == 'minibatch'):
+		raise ValueError('The minibatch engine cannot resume from a checkpoint')
+	
 	vprint('Initializing variables', 1)
+	t_start = time.perf_counter()
 	# Initialize arrays and data structures	
 	# Dict for holding execution time values
 	time_profile = {}
 	
-	# Cluster categorization array
-	clusters = np.ndarray(
-		shape = [data.shape[0]],
-		dtype = get_spuid(k)
-	)
 	# Array used for get_means
 	mean_count = np.ones([k, data.shape[1]], dtype = np.uint32)
 	
@@ -53,69 +113,426 @@ def k_means(data, k, distance_f, init_f, datap_to_hashable, hashable_to_datap):
 	# Get unique datapoints, their mapping to the original dataset
 	# and element count for faster clusterization
 	t0 = time.perf_counter()
-	unique_datap, el_count, mapping = get_uniques_mapping(data, datap_to_hashable, hashable_to_datap)
+	if(uniques is not None):
+		unique_datap, el_count, inverse = uniques
+	elif(datap_to_hashable is None):
+		unique_datap, el_count, inverse = get_uniques_inverse(data)
+	else:
+		unique_datap, el_count, mapping = get_uniques_mapping(data, datap_to_hashable, hashable_to_datap)
 	t1 = time.perf_counter()
 	time_profile['unique_mapping'] = t1 - t0
 	
+	# Identifies the run a checkpoint belongs to
+	if(checkpoint is not None):
+		fingerprint = checkpoint_fingerprint(unique_datap, el_count, k, distance_f, init_f, weighted, init_means)
+	
+	# Distances defined on another space work on converted datapoints
+	to_space = getattr(distance_f, 'to_space', None)
+	if(to_space is not None):
+		t0 = time.perf_counter()
+		unique_datap = to_space(unique_datap)
+		t1 = time.perf_counter()
+		time_profile['space_conversion'] = t1 - t0
+	
+	# Cluster categorization array of the unique datapoints
+	clusters = np.ndarray(
+		shape = [unique_datap.shape[0]],
+		dtype = get_spuid(k)
+	)
+	
+	# Saved state of an interrupted run
+	state = None
+	if(resume and checkpoint is not None and os.path.exists(checkpoint)):
+		vprint('Resuming from {}'.format(checkpoint), 1)
+		state = load_checkpoint(checkpoint, k, clusters.shape[0], fingerprint)
+	
 	vprint('Choosing starting points', 1)
 	# Initialize cluster
 	t0 = time.perf_counter()
-	c_means = init_f(unique_datap, el_count, k, distance_f).astype(c_means.dtype)
+	if(state is not None):
+		c_means[:] = state['c_means']
+	elif(init_means is None):
+		c_means = init_f(unique_datap, el_count, k, distance_f).astype(c_means.dtype)
+	else:
+		c_means[:] = init_means if to_space is None else to_space(init_means)
 	t1 = time.perf_counter()
 	time_profile['init_point_selection'] = t1 - t0
 	
-	# Send to garbage collector since it won't be used again
-	del el_count
-	
-	vprint('Performing initial clusterization', 1)
-	# Initial clusterization and mse
-	clusterize(unique_datap, c_means, clusters, distance_f)
-	mse = get_mse(unique_datap, clusters, c_means, distance_f)
+	# Weights for get_means and get_mse
+	if(weighted):
+		weights = el_count
+	else:
+		weights = None
 	
-	vprint('Entering loop', 1)
-	while(True):
-		# Update means
-		get_means(unique_datap, clusters, c_means, old_means, mean_count, distance_f)
-		vprint('After get_means ', 2)
+	if(weights is None):
+		total_weight = unique_datap.shape[0]
+	else:
+		total_weight = np.sum(weights, dtype = np.float64)
+	
+	# Worker threads and processes are released even when the run
+	# raises or is interrupted
+	executor = None
+	assigner = None
+	try:
+		# Thread pool for the assignment blocks of the engines that use it
+		if(workers > 1 and engine in ['lloyd', 'minibatch']):
+			executor = ThreadPoolExecutor(workers)
+		parallel_stats = {'busy': 0.0}
 		
-		# If means didn't change, break the loop
-		if(np.all(np.absolute(c_means - old_means) < EPS_F32)):
-			break
-			
-		# Reclusterize
-		clusterize(unique_datap, c_means, clusters, distance_f)
-		vprint('After clusterize', 2)
+		# Time spent on the mse by the engines that don't fuse it with the
+		# assignment
+		step_times = {'mse': 0.0}
 		
-		# MSE
-		old_mse = mse
-		mse = get_mse(unique_datap, clusters, c_means, distance_f)
+		# Distances computed outside the hamerly and kd-tree assigners,
+		# which count their own
+		evaluations = {'count': 0}
 		
-		# If mse doesn't change, break the loop
-		if(old_mse - mse < EPS_F32):
-			break
+		# Iteration step of the selected engine, it assigns the datapoints
+		# and returns the sum and count of every cluster and the mse
+		if(engine in ['lloyd', 'minibatch']):
+			def step_f(c_means, clusters):
+				sums, count, sq_error = assign_accumulate(
+					unique_datap, c_means, clusters, distance_f, weights,
+					chunk_size, executor, parallel_stats
+				)
+				evaluations['count'] += unique_datap.shape[0] * k
+				return sums, count, sq_error/total_weight
+		elif(engine == 'hamerly'):
+			assigner = HamerlyAssigner(unique_datap, distance_f, chunk_size)
+			def step_f(c_means, clusters):
+				assigner.assign(c_means, clusters)
+				sums, count = get_sums(unique_datap, clusters, k, weights)
+				t0 = time.perf_counter()
+				mse = get_mse(unique_datap, clusters, c_means, distance_f, weights, chunk_size)
+				step_times['mse'] = time.perf_counter() - t0
+				return sums, count, mse
+		elif(engine == 'kdtree'):
+			vprint('Building kd-tree', 1)
+			t0 = time.perf_counter()
+			assigner = KdTreeAssigner(unique_datap, distance_f, weights)
+			t1 = time.perf_counter()
+			time_profile['kdtree_build'] = t1 - t0
+			def step_f(c_means, clusters):
+				assigner.assign(c_means, clusters)
+				t0 = time.perf_counter()
+				mse = get_mse(unique_datap, clusters, c_means, distance_f, weights, chunk_size)
+				step_times['mse'] = time.perf_counter() - t0
+				return assigner.sums, assigner.counts, mse
+		elif(engine == 'sharded'):
+			vprint('Starting {} shard workers'.format(workers), 1)
+			t0 = time.perf_counter()
+			assigner = ShardedAssigner(unique_datap, distance_f, weights, workers, chunk_size, clusters.dtype)
+			t1 = time.perf_counter()
+			time_profile['shard_startup'] = t1 - t0
+			def step_f(c_means, clusters):
+				sums, count, sq_error = assigner.step(c_means, clusters)
+				evaluations['count'] += unique_datap.shape[0] * k
+				return sums, count, sq_error/total_weight
 		
-		# If MSE doesn't change too much or increases, break the loop
-		mse_change = (mse - old_mse)/old_mse
+		if(engine == 'minibatch'):
+			vprint('Running mini-batches', 1)
+			time_profile['mini_batches'] = minibatch_means(
+				unique_datap, el_count, c_means, distance_f,
+				batch_size, max_batches, drift_tol, seed, chunk_size
+			)
+			evaluations['count'] += time_profile['mini_batches'] * batch_size * k
 		
-		if(mse_change > 0 or abs(mse_change) < 0.001):
-			break
-	
-	vprint('Remapping values to match original data', 1)
-	# Remapping unique clusters to original dataset
-	t0 = time.perf_counter()
-	clusters_mapping = np.ndarray(
-		shape = [data.shape[0]],
-		dtype = get_spuid(k)
-	)
-	for i in range(len(mapping)):
-		for idx in mapping[i]:
-			clusters_mapping[idx] = clusters[i]
-	t1 = time.perf_counter()
-	time_profile['unique_demapping'] = t1 - t0
+		# Send to garbage collector since it won't be used again
+		del el_count
+		
+		vprint('Performing initial clusterization', 1)
+		# Wall time of every phase of the iterations
+		time_profile['assignment'] = 0.0
+		time_profile['update'] = 0.0
+		
+		# Initial clusterization, cluster sums and mse
+		t0 = time.perf_counter()
+		if(state is not None):
+			clusters[:] = state['clusters']
+			sums = state['sums']
+			count = state['count']
+			mse_history = list(state['mse_history'])
+			mse = mse_history[-1]
+		elif(init_clusters is None or engine == 'minibatch'):
+			sums, count, mse = step_f(c_means, clusters)
+		else:
+			unknown = np.flatnonzero(init_clusters < 0)
+			known = np.flatnonzero(init_clusters >= 0)
+			clusters[known] = init_clusters[known]
+			unknown_clusters = np.ndarray([unknown.shape[0]], dtype = clusters.dtype)
+			assign(unique_datap[unknown], c_means, unknown_clusters, distance_f, chunk_size)
+			evaluations['count'] += unknown.shape[0] * k
+			clusters[unknown] = unknown_clusters
+			time_profile['known_clusters'] = known.shape[0]
+		
+			sums, count = get_sums(unique_datap, clusters, k, weights)
+			mse = get_mse(unique_datap, clusters, c_means, distance_f, weights, chunk_size)
+		t1 = time.perf_counter()
+		time_profile['assignment'] += t1 - t0
+		
+		# Iteration records, only built when someone asked for them
+		instrument = trace is not None or callback is not None
+		cancelled = False
+		if(instrument):
+			cancelled = report_iteration(trace, callback, {
+				'iteration': 0 if state is None else state['iteration'],
+				'assign_time': t1 - t0 - step_times['mse'],
+				'update_time': 0.0,
+				'mse_time': step_times['mse'],
+				'mse': float(mse),
+				'center_shift': 0.0,
+				'reassigned': clusters.shape[0]
+			})
+		
+		if(state is None):
+			iteration = 0
+			mse_history = [mse]
+		else:
+			iteration = state['iteration']
+		if(checkpoint_iters is None and checkpoint_seconds is None):
+			checkpoint_iters = 1
+		last_checkpoint = time.perf_counter()
+		time_profile['checkpoint'] = 0.0
+		
+		vprint('Entering loop', 1)
+		while(engine != 'minibatch' and not cancelled):
+			# Stop on the budget, the state is saved so the run can go on
+			over_iters = max_iter is not None and iteration >= max_iter
+			over_time = time_budget is not None and time.perf_counter() - t_start >= time_budget
+			if(over_iters or over_time):
+				vprint('Budget reached after {} iterations'.format(iteration), 1)
+				time_profile['budget_stop'] = 1.0
+				if(checkpoint is not None):
+					t0 = time.perf_counter()
+					save_checkpoint(checkpoint, fingerprint, iteration, c_means, clusters, sums, count, mse_history)
+					time_profile['checkpoint'] += time.perf_counter() - t0
+				break
+		
+			# Periodic checkpoint of the state at the start of the iteration
+			if(checkpoint is not None):
+				t0 = time.perf_counter()
+				due_iters = checkpoint_iters is not None and iteration % checkpoint_iters == 0
+				due_seconds = checkpoint_seconds is not None and t0 - last_checkpoint >= checkpoint_seconds
+				if(due_iters or due_seconds):
+					save_checkpoint(checkpoint, fingerprint, iteration, c_means, clusters, sums, count, mse_history)
+					last_checkpoint = time.perf_counter()
+					time_profile['checkpoint'] += last_checkpoint - t0
+		
+			iteration += 1
+			if(instrument):
+				old_clusters = clusters.copy()
+		
+			# Update means
+			t0 = time.perf_counter()
+			update_means(c_means, old_means, mean_count, sums, count)
+			update_time = time.perf_counter() - t0
+			time_profile['update'] += update_time
+			vprint('After update_means', 2)
+		
+			# If means didn't change, the loop ends after this iteration
+			converged = np.all(np.absolute(c_means - old_means) < EPS_F32)
+		
+			# Reclusterize, accumulating the sums for the next update
+			old_mse = mse
+			assign_time = 0.0
+			step_times['mse'] = 0.0
+			if(not converged):
+				t0 = time.perf_counter()
+				sums, count, mse = step_f(c_means, clusters)
+				assign_time = time.perf_counter() - t0
+				time_profile['assignment'] += assign_time
+				mse_history.append(mse)
+				vprint('After clusterize', 2)
+		
+			if(instrument):
+				shift = np.sqrt(np.sum((c_means.astype(np.float64) - old_means)**2, axis = 1))
+				cancelled = report_iteration(trace, callback, {
+					'iteration': iteration,
+					'assign_time': assign_time - step_times['mse'],
+					'update_time': update_time,
+					'mse_time': step_times['mse'],
+					'mse': float(mse),
+					'center_shift': float(np.max(shift)),
+					'reassigned': int(np.count_nonzero(clusters != old_clusters))
+				})
+				if(cancelled):
+					break
+		
+			if(converged):
+				break
+		
+			# If mse doesn't change, break the loop
+			if(old_mse - mse < EPS_F32):
+				break
+		
+			# If MSE doesn't change too much or increases, break the loop
+			mse_change = (mse - old_mse)/old_mse
+		
+			if(mse_change > 0 or abs(mse_change) < 0.001):
+				break
+		
+		time_profile['iterations'] = iteration
+		if(cancelled):
+			vprint('Cancelled after {} iterations'.format(iteration), 1)
+			time_profile['cancelled'] = 1.0
+		
+		if(executor is not None):
+			# Share of the workers' time spent on assignment blocks
+			time_profile['parallel_efficiency'] = parallel_stats['busy'] / (time_profile['assignment'] * workers)
+		
+		if(engine in ['hamerly', 'kdtree']):
+			evaluations['count'] += assigner.evaluations
+		time_profile['distance_evaluations'] = evaluations['count']
+		
+		if(engine == 'hamerly'):
+			time_profile['skipped_distances'] = assigner.skipped
+		
+		vprint('Remapping values to match original data', 1)
+		# Remapping unique clusters to original dataset
+		t0 = time.perf_counter()
+		if(uniques is not None or datap_to_hashable is None):
+			clusters_mapping = clusters[inverse]
+		else:
+			clusters_mapping = np.ndarray(
+				shape = [data.shape[0]],
+				dtype = get_spuid(k)
+			)
+			for i in range(len(mapping)):
+				for idx in mapping[i]:
+					clusters_mapping[idx] = clusters[i]
+		t1 = time.perf_counter()
+		time_profile['unique_demapping'] = t1 - t0
+	finally:
+		if(executor is not None):
+			executor.shutdown()
+		if(engine == 'sharded' and assigner is not None):
+			assigner.close()
+	
+	if(to_space is not None):
+		c_means = distance_f.from_space(c_means).astype(c_means.dtype)
 	
 	return c_means, clusters_mapping, mse, time_profile
 	
-def clusterize(data, c_means, clusters, distance_f):
+def report_iteration(trace, callback, record):
+	"""
+	hands the record of an iteration to the trace and the callback of
+	k_means, the record has
+	iteration: int, 0 is the initial clusterization
+	assign_time: float, seconds assigning the datapoints
+	update_time: float, seconds updating the means
+	mse_time: float, seconds computing the mse apart from the
+	assignment, 0 for the engines that compute both at once
+	mse: float
+	center_shift: float, largest distance a mean moved
+	reassigned: int, unique datapoints whose cluster changed
+	
+	Arguments:
+	trace: list or None
+	callback: function of dict -> bool or None
+	record: dict of string -> value
+	
+	Output:
+	cancel: bool, the callback asked to stop
+	"""
+	if(trace is not None):
+		trace.append(record)
+	if(callback is not None):
+		return bool(callback(record))
+	
+	return False
+	
+def checkpoint_fingerprint(unique_datap, el_count, k, distance_f, init_f, weighted, init_means):
+	"""
+	returns the hash of the unique datapoints, their counts and the
+	parameters that change the result of a run, stored in its
+	checkpoints so a run never resumes from the state of another one
+	
+	Arguments:
+	unique_datap: numpy 2d numerical array
+	el_count: numpy 1d numerical array
+	k: int
+	distance_f: function of datapoint x datapoint -> float
+	init_f: function of 2d array x 1d array x int x function -> 2d array
+	weighted: bool
+	init_means: numpy 2d numerical array or None
+	
+	Output:
+	fingerprint: string
+	"""
+	h = hashlib.sha1()
+	h.update(np.ascontiguousarray(unique_datap).tobytes())
+	h.update(np.ascontiguousarray(el_count).tobytes())
+	h.update(repr((unique_datap.shape, str(unique_datap.dtype), k, weighted)).encode())
+	h.update(function_name(distance_f).encode())
+	h.update(function_name(init_f).encode())
+	if(init_means is not None):
+		h.update(np.ascontiguousarray(init_means).tobytes())
+	
+	return h.hexdigest()
+	
+def save_checkpoint(path, fingerprint, iteration, c_means, clusters, sums, count, mse_history):
+	"""
+	saves the state of the k-means loop at the start of an iteration,
+	the file is written under a temporary name and renamed so an
+	interrupted save never leaves a broken checkpoint
+	
+	Arguments:
+	path: string
+	fingerprint: string, checkpoint_fingerprint of the run
+	iteration: int
+	c_means: numpy 2d numerical array
+	clusters: numpy 1d numerical array, clusters of the unique datapoints
+	sums: numpy 2d numerical array
+	count: numpy 1d numerical array
+	mse_history: list of float
+	"""
+	tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+	with open(tmp_path, 'wb') as f:
+		np.savez(
+			f,
+			fingerprint = np.array(fingerprint),
+			iteration = np.int64(iteration),
+			c_means = c_means,
+			clusters = clusters,
+			sums = sums,
+			count = count,
+			mse_history = np.array(mse_history, dtype = np.float64)
+		)
+	os.replace(tmp_path, path)
+	
+def load_checkpoint(path, k, n_uniques, fingerprint):
+	"""
+	reads a checkpoint written by save_checkpoint and checks it belongs
+	to a run with k clusters over n_uniques unique datapoints with the
+	same fingerprint
+	
+	Arguments:
+	path: string
+	k: int
+	n_uniques: int
+	fingerprint: string, checkpoint_fingerprint of the run
+	
+	Output:
+	state: dict of string -> value
+	"""
+	with np.load(path) as f:
+		state = dict((name, f[name]) for name in f.files)
+	state['iteration'] = int(state['iteration'])
+	
+	if(state['c_means'].shape[0] != k or state['clusters'].shape[0] != n_uniques):
+		error_msg = 'Checkpoint {} has {} clusters and {} unique datapoints,'
+		error_msg += ' expected {} and {}'
+		raise ValueError(error_msg.format(
+			path, state['c_means'].shape[0], state['clusters'].shape[0], k, n_uniques
+		))
+	
+	# Same shapes can still come from another image or parameters
+	if(str(state.get('fingerprint')) != fingerprint):
+		raise ValueError('Checkpoint {} belongs to another run'.format(path))
+	
+	return state
+	
+def clusterize(data, c_means, clusters, distance_f, chunk_size = CHUNK_SIZE):
 	"""
 	given a list of datapoints and a list of means it returns a new 
 	categorization of the data by clusters with c_means as central points
@@ -124,18 +541,16 @@ def clusterize(data, c_means, clusters, distance_f):
 	data: numpy 2d numerical array
 	c_means: numpy 2d numerical array
 	clusters: numpy 1d numerical array
-	k: int
 	distance_f: function of datapoint x datapoint -> float
+	chunk_size: int
 	"""
 	
-	# For every datapoint search the cluster it is the nearest to
-	# and assign the index(cluster id) to the clusters categorization
-	# array
-	for j, datap in enumerate(data):
-		distances = distance_f(datap, c_means)	
-		clusters[j] = np.argmin(distances)
+	# For every block of datapoints search the cluster each one is the
+	# nearest to and assign the index(cluster id) to the clusters
+	# categorization array
+	assign(data, c_means, clusters, distance_f, chunk_size)
 	
-def get_means(data, clusters, new_means, old_means, mean_count, distance_f):
+def get_means(data, clusters, new_means, old_means, mean_count, distance_f, weights = None):
 	"""
 	given a list of datapoints, a cluster categorization of these and
 	it's central points, it returns the new means of this cluster
@@ -145,22 +560,34 @@ def get_means(data, clusters, new_means, old_means, mean_count, distance_f):
 	data: numpy 2d numerical array
 	clusters: numpy 2d numerical array
 	old_means: numpy 2d numerical array
+	weights: numpy 1d numerical array, amount of times each datapoint
+	appears, None counts every datapoint once
 	
 	Output:
 	new_means numpy 2d numerical array
 	"""
-	np.copyto(old_means, new_means)
-	mean_count.fill(1)
+	sums, count = get_sums(data, clusters, new_means.shape[0], weights)
+	update_means(new_means, old_means, mean_count, sums, count)
 	
-	for i in range(data.shape[0]):
-		idx = clusters[i]
-		new_means[idx] = new_means[idx] + data[i]
-		mean_count[idx] += 1
-		
-	for i in range(new_means.shape[0]):
-		new_means[i] = new_means[i] / mean_count[i]
+def update_means(new_means, old_means, mean_count, sums, count):
+	"""
+	given the sum and count of the datapoints of every cluster it moves
+	the means to the mean of their cluster, every mean counts as one
+	datapoint of its own cluster so clusters without datapoints keep
+	their central point
+	
+	Arguments:
+	new_means: numpy 2d numerical array
+	old_means: numpy 2d numerical array
+	mean_count: numpy 2d numerical array
+	sums: numpy 2d numerical array
+	count: numpy 1d numerical array
+	"""
+	np.copyto(old_means, new_means)
+	mean_count[:] = (count + 1)[:, np.newaxis]
+	new_means[:] = (new_means + sums) / mean_count
 	
-def get_mse(data, clusters, c_means, distance_f):
+def get_mse(data, clusters, c_means, distance_f, weights = None, chunk_size = CHUNK_SIZE):
 	"""
 	given a list of datapoints, a cluster categorization of these and
 	it's central points, it returns the Mean Square Error, a meassurement
@@ -170,15 +597,20 @@ def get_mse(data, clusters, c_means, distance_f):
 	data: numpy 2d numerical array
 	clusters: numpy 2d numerical array
 	c_means: numpy 2d numerical array
+	weights: numpy 1d numerical array, amount of times each datapoint
+	appears, None counts every datapoint once
+	chunk_size: int, blocks the squared distances are added in
 	
 	Outpu:
 	mse: float
 	"""
-	mse = 0
-	for i in range(data.shape[0]):
-		mse += np.power(distance_f(data[i], c_means[clusters[i]]), 2)
+	# Same squared distances and additions as the fused Lloyd pass
+	sq_error = squared_error(data, c_means, clusters, distance_f, weights, chunk_size)
+	
+	if(weights is None):
+		return sq_error/data.shape[0]
 		
-	return mse/data.shape[0]
+	return sq_error/np.sum(weights, dtype = np.float64)
 	
 def get_uniques_mapping(data, datap_to_hashable, hashable_to_datap):
 	"""
@@ -218,6 +650,35 @@ def get_uniques_mapping(data, datap_to_hashable, hashable_to_datap):
 	
 	return unique_elems, count, mapping
 	
+def get_uniques_inverse(data):
+	"""
+	returns unique pixels together with the count for each element and
+	an inverse index such that unique_elems[inverse] == data, pixels are
+	packed into 24 bit integers so they are compared in bulk
+	
+	Arguments:
+	data: numpy 2d uint8 array with shape [n, 3]
+	
+	Output:
+	unique_elems: numpy 2d uint8 array
+	count: numpy 1d numerical array
+	inverse: numpy 1d numerical array
+	"""
+	if(data.ndim != 2 or data.shape[1] != 3 or data.dtype != np.uint8):
+		error_msg = 'Packed unique extraction needs uint8 pixels with'
+		error_msg += ' shape [n, 3], got {} with shape {}'
+		raise ValueError(error_msg.format(data.dtype, data.shape))
+	
+	packed, inverse, count = np.unique(
+		pixels_to_int(data),
+		return_inverse = True,
+		return_counts = True
+	)
+	unique_elems = ints_to_pixels(packed)
+	inverse = inverse.reshape([-1]).astype(get_spuid(packed.shape[0]))
+	
+	return unique_elems, count.astype(np.uint32), inverse
+	
 def get_spuid(k):
 	"""
 	returns the Smallest Possible UInt Dtype that can fit k different
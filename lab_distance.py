@@ -0,0 +1,206 @@
+import numpy as np
+import argparse
+import time
+import cv2
+
+# D65 reference white and sRGB to XYZ matrix
+WHITE = np.array([0.95047, 1.0, 1.08883])
+RGB_TO_XYZ = np.array([
+	[0.4124564, 0.3575761, 0.1804375],
+	[0.2126729, 0.7151522, 0.0721750],
+	[0.0193339, 0.1191920, 0.9503041]
+])
+XYZ_TO_RGB = np.linalg.inv(RGB_TO_XYZ)
+
+# Breakpoint of the cube root of the Lab transfer function
+DELTA = 6/29
+
+def rgb_to_lab(rgb):
+	"""
+	returns sRGB colors in CIE Lab with a D65 white
+
+	Arguments:
+	rgb: numpy 2d numerical array with shape [n, 3] in [0, 255]
+
+	Output:
+	lab: numpy 2d float64 array with shape [n, 3]
+	"""
+	c = rgb.astype(np.float64) / 255
+	linear = np.where(c <= 0.04045, c / 12.92, ((c + 0.055) / 1.055)**2.4)
+	t = np.dot(linear, RGB_TO_XYZ.T) / WHITE
+	f = np.where(t > DELTA**3, np.cbrt(t), t / (3*DELTA**2) + 4/29)
+
+	lab = np.empty(f.shape, dtype = np.float64)
+	lab[:, 0] = 116*f[:, 1] - 16
+	lab[:, 1] = 500*(f[:, 0] - f[:, 1])
+	lab[:, 2] = 200*(f[:, 1] - f[:, 2])
+
+	return lab
+
+def lab_to_rgb(lab):
+	"""
+	returns CIE Lab colors in sRGB, clipped to [0, 255]
+
+	Arguments:
+	lab: numpy 2d numerical array with shape [n, 3]
+
+	Output:
+	rgb: numpy 2d float64 array with shape [n, 3]
+	"""
+	lab = lab.astype(np.float64)
+	f = np.empty(lab.shape, dtype = np.float64)
+	f[:, 1] = (lab[:, 0] + 16) / 116
+	f[:, 0] = f[:, 1] + lab[:, 1] / 500
+	f[:, 2] = f[:, 1] - lab[:, 2] / 200
+	t = np.where(f > DELTA, f**3, 3*DELTA**2 * (f - 4/29)) * WHITE
+
+	linear = np.clip(np.dot(t, XYZ_TO_RGB.T), 0, 1)
+	c = np.where(linear <= 0.0031308, 12.92*linear, 1.055*linear**(1/2.4) - 0.055)
+
+	return np.clip(c * 255, 0, 255)
+
+def lab_distance(p1, p2):
+	"""
+	euclidean distance between colors already converted to Lab
+
+	Arguments:
+	p1: numpy 1d/2d numerical array
+	p2: numpy 1d/2d numerical array
+
+	Output:
+	dis: float/numpy 1d numerical array
+	"""
+	px = p1.astype(np.float64) - p2.astype(np.float64)
+
+	return np.sqrt(np.sum(px*px, axis = -1))
+
+def lab_pairwise_distance(p1, p2, squared = False):
+	"""
+	returns the distance between every color of p1 and every color of
+	p2 as ||x||^2 - 2 x.c + ||c||^2, so the bulk of the work is a single
+	matrix product
+
+	Arguments:
+	p1: numpy 2d numerical array with shape [n, 3]
+	p2: numpy 2d numerical array with shape [k, 3]
+	squared: bool, skip the square root
+
+	Output:
+	dis: numpy 2d float64 array with shape [n, k]
+	"""
+	p1 = p1.astype(np.float64)
+	p2 = p2.astype(np.float64)
+
+	dis = np.dot(p1, -2*p2.T)
+	dis += np.einsum('ij,ij->i', p1, p1)[:, np.newaxis]
+	dis += np.einsum('ij,ij->i', p2, p2)
+	# Cancellation can leave tiny negative values
+	np.maximum(dis, 0, out = dis)
+
+	if(not squared):
+		np.sqrt(dis, out = dis)
+
+	return dis
+
+def lab_box_bounds(lo, hi, p2):
+	"""
+	returns a lower and an upper bound of the squared distance from any
+	color inside the box [lo, hi] to every color of p2, same shapes as
+	rgb_distance.rgb_box_bounds
+
+	Arguments:
+	lo: numpy 1d numerical array with shape [3] or [m, 1, 3]
+	hi: numpy 1d numerical array with shape [3] or [m, 1, 3]
+	p2: numpy 2d numerical array with shape [k, 3]
+
+	Output:
+	lower: numpy float64 array with shape [k] or [m, k]
+	upper: numpy float64 array with shape [k] or [m, k]
+	"""
+	p2 = p2.astype(np.float64)
+	below = np.maximum(lo - p2, 0)
+	above = np.maximum(p2 - hi, 0)
+	lower = np.sum(below*below + above*above, axis = -1)
+
+	far = np.maximum(np.absolute(lo - p2), np.absolute(hi - p2))
+	upper = np.sum(far*far, axis = -1)
+
+	return lower, upper
+
+# N x K kernel used by the assignment engine
+lab_distance.pairwise = lab_pairwise_distance
+
+# Bounds used by the kd-tree engine to discard central points
+lab_distance.box_bounds = lab_box_bounds
+
+# An euclidean distance obeys the triangle inequality
+lab_distance.lipschitz = 1.0
+
+# k_means converts the unique colors to Lab once and the means back to
+# rgb at the end
+lab_distance.to_space = rgb_to_lab
+lab_distance.from_space = lab_to_rgb
+
+if __name__ == '__main__':
+	from rgb_distance import rgb_distance
+	from assignment import assign
+
+	# Throughput of a full assignment pass with both distances
+	ap = argparse.ArgumentParser(
+		description = 'Compare the assignment throughput of lab_distance and rgb_distance'
+	)
+	ap.add_argument(
+		'-i',
+		'--images',
+		nargs = '*',
+		default = [],
+		help = 'Images whose unique colors are assigned, random colors when none'
+	)
+	ap.add_argument(
+		'-c',
+		'--colors',
+		nargs = '+',
+		type = int,
+		default = [16, 64, 256],
+		help = 'Amounts of central points'
+	)
+	ap.add_argument(
+		'-r',
+		'--repeats',
+		type = int,
+		default = 3,
+		help = 'Passes timed per case, the best one is kept'
+	)
+	args = ap.parse_args()
+
+	datasets = []
+	for im_path in args.images:
+		image = cv2.cvtColor(cv2.imread(im_path), cv2.COLOR_BGR2RGB).reshape([-1, 3])
+		datasets.append((im_path, np.unique(image, axis = 0)))
+	if(not datasets):
+		rand_state = np.random.RandomState(0)
+		datasets.append(('random', np.unique(rand_state.randint(0, 256, [200000, 3]).astype(np.uint8), axis = 0)))
+
+	for name, colors in datasets:
+		t0 = time.perf_counter()
+		lab_colors = rgb_to_lab(colors)
+		conversion = time.perf_counter() - t0
+		print('{}: {} unique colors, Lab conversion {:.4f}s'.format(name, colors.shape[0], conversion))
+
+		for k in args.colors:
+			means = colors[np.linspace(0, colors.shape[0] - 1, k).astype(int)]
+			lab_means = rgb_to_lab(means)
+			clusters = np.ndarray([colors.shape[0]], dtype = np.uint16)
+
+			times = {}
+			for label, data, c_means, distance_f in [('rgb', colors, means, rgb_distance), ('lab', lab_colors, lab_means, lab_distance)]:
+				best = float('inf')
+				for _ in range(args.repeats):
+					t0 = time.perf_counter()
+					assign(data, c_means, clusters, distance_f)
+					best = min(best, time.perf_counter() - t0)
+				times[label] = best
+
+			print('  k={}: rgb {:.0f} colors/s, lab {:.0f} colors/s, speedup {:.2f}x'.format(
+				k, colors.shape[0] / times['rgb'], colors.shape[0] / times['lab'], times['rgb'] / times['lab']
+			))
@@ -0,0 +1,283 @@
+from kmeans import k_means, get_uniques_inverse, ENGINES
+from rgb_distance import rgb_distance
+from initializers.random_init import random_init
+from image_compressor import read_image, build_indexed, get_table_aid
+from engines.sharded import shared_dir, share_array, open_array
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+import multiprocessing
+import numpy as np
+import argparse
+import shutil
+import time
+import cv2
+import os
+import utils
+
+# Unique colors of the worker process and the best mse found by any
+# restart, set by init_restart_worker
+worker_state = {}
+
+def init_restart_worker(layout, best_mse, vlevel):
+	"""
+	opens the memory-mapped unique colors of multi_start in a worker
+	process
+	"""
+	utils.vlevel = vlevel
+	n = layout['n']
+
+	worker_state['unique_datap'] = open_array(layout['dir'], 'unique_datap', np.uint8, (n, 3))
+	worker_state['el_count'] = open_array(layout['dir'], 'el_count', layout['count_dtype'], (n,))
+	worker_state['best_mse'] = best_mse
+
+def run_restart(seed, k, abandon_margin, abandon_after, kmeans_args):
+	"""
+	runs k-means on the shared unique colors starting from k of them
+	chosen with seed, the restart is abandoned once its mse stays above
+	the best one found so far by more than abandon_margin after
+	abandon_after iterations
+
+	Arguments:
+	seed: int
+	k: int
+	abandon_margin: float or None, None never abandons
+	abandon_after: int
+	kmeans_args: dict of keyword arguments for kmeans.k_means
+
+	Output:
+	seed: int
+	c_means: numpy 2d numerical array, None if abandoned
+	clusters: numpy 1d numerical array, cluster of every unique color
+	mse: float
+	aid: float
+	time_profile: dict of string -> float
+	"""
+	unique_datap = np.asarray(worker_state['unique_datap'])
+	el_count = np.asarray(worker_state['el_count'])
+	best_mse = worker_state['best_mse']
+
+	callback = None
+	if(abandon_margin is not None):
+		def callback(record):
+			return record['iteration'] >= abandon_after and record['mse'] > best_mse.value * (1 + abandon_margin)
+
+	# Every unique color is its own datapoint
+	uniques = (unique_datap, el_count, np.arange(unique_datap.shape[0]))
+	init_f = partial(random_init, rand_state = np.random.RandomState(seed))
+	c_means, clusters, mse, time_profile = k_means(
+		unique_datap, k, rgb_distance, init_f,
+		uniques = uniques,
+		callback = callback,
+		**kmeans_args
+	)
+	if(time_profile.get('cancelled')):
+		return seed, None, None, mse, None, time_profile
+
+	with best_mse.get_lock():
+		best_mse.value = min(best_mse.value, mse)
+
+	aid = get_table_aid(uniques, c_means, clusters)
+
+	return seed, c_means, clusters, mse, aid, time_profile
+
+def multi_start(im_path, k, restarts = 10, seed = 0, processes = None, abandon_margin = None, abandon_after = 3, indexed = False, **kmeans_args):
+	"""
+	compresses an image with restarts from seeded random starting
+	points run in parallel, the image is decoded and its unique colors
+	extracted once and shared with the workers through memory-mapped
+	files, only the results with the best mse and the best aid are kept
+
+	Restart i uses seed + i so the same arguments give the same results
+	when no restart is abandoned, ties go to the lowest seed
+
+	Arguments:
+	im_path: string
+	k: int
+	restarts: int
+	seed: int
+	processes: int, None uses every core
+	abandon_margin: float or None, relative mse above the best finished
+	restart at which a restart is abandoned, None runs every restart to
+	the end
+	abandon_after: int, iterations a restart runs before it can be
+	abandoned
+	indexed: bool, return the compressed images as IndexedImage
+	kmeans_args: keyword arguments for kmeans.k_means
+
+	Output:
+	image: numpy 3d uint8 array in bgr
+	best_mse: (seed, c_means, compressed_image, mse, aid)
+	best_aid: (seed, c_means, compressed_image, mse, aid)
+	time_profile: dict of string -> float
+	"""
+	if(processes is None):
+		processes = os.cpu_count()
+
+	time_profile = {}
+	image = read_image(im_path)
+
+	# Unique colors in rgb order from a reversed view of the bgr pixels
+	t0 = time.perf_counter()
+	unique_datap, el_count, inverse = get_uniques_inverse(image.reshape([-1, 3])[:, ::-1])
+	t1 = time.perf_counter()
+	time_profile['unique_mapping'] = t1 - t0
+
+	if(k > unique_datap.shape[0]):
+		error_msg = 'Random restarts need at least {} unique colors, the image has {}'
+		raise ValueError(error_msg.format(k, unique_datap.shape[0]))
+
+	directory = shared_dir('kmeans_restarts_')
+	try:
+		share_array(directory, 'unique_datap', unique_datap)
+		share_array(directory, 'el_count', el_count)
+		layout = {
+			'dir': directory,
+			'n': unique_datap.shape[0],
+			'count_dtype': el_count.dtype.str
+		}
+		best_shared = multiprocessing.Value('d', float('inf'))
+
+		t0 = time.perf_counter()
+		with ProcessPoolExecutor(
+			processes,
+			initializer = init_restart_worker,
+			initargs = (layout, best_shared, utils.vlevel if utils.vlevel is not None else 0)
+		) as executor:
+			futures = [
+				executor.submit(run_restart, seed + i, k, abandon_margin, abandon_after, kmeans_args)
+				for i in range(restarts)
+			]
+
+			# Results are taken in seed order and dropped unless they are
+			# the best so far
+			best_mse = None
+			best_aid = None
+			abandoned = 0
+			k_means_time = 0.0
+			for future in futures:
+				r_seed, c_means, clusters, mse, aid, r_profile = future.result()
+				k_means_time += sum(r_profile.get(key, 0.0) for key in ['init_point_selection', 'assignment', 'update'])
+				if(c_means is None):
+					abandoned += 1
+					continue
+
+				result = (r_seed, c_means, clusters, mse, aid)
+				if(best_mse is None or mse < best_mse[3]):
+					best_mse = result
+				if(best_aid is None or aid < best_aid[4]):
+					best_aid = result
+		t1 = time.perf_counter()
+	finally:
+		shutil.rmtree(directory, ignore_errors = True)
+
+	time_profile['restarts'] = restarts
+	time_profile['abandoned'] = abandoned
+	time_profile['k_means'] = k_means_time
+	time_profile['multi_start'] = t1 - t0
+
+	# Only the two kept results are expanded to images
+	def expand(result):
+		r_seed, c_means, clusters, mse, aid = result
+		compressed_image = build_indexed(c_means, clusters[inverse], image.shape)
+		if(not indexed):
+			compressed_image = compressed_image.to_bgr()
+		return r_seed, c_means, compressed_image, mse, aid
+
+	return image, expand(best_mse), expand(best_aid), time_profile
+
+if __name__ == '__main__':
+
+	# Script arguments
+	ap = argparse.ArgumentParser(
+		description = 'Compress an image with the best of many random restarts'
+	)
+	ap.add_argument(
+		'-i',
+		'--image',
+		required = True,
+		help = 'Path to image'
+	)
+	ap.add_argument(
+		'-c',
+		'--colors',
+		required = True,
+		type = int,
+		help = 'Number of colors'
+	)
+	ap.add_argument(
+		'-r',
+		'--restarts',
+		type = int,
+		default = 10,
+		help = 'Amount of random restarts'
+	)
+	ap.add_argument(
+		'--seed',
+		type = int,
+		default = 0,
+		help = 'Seed of the first restart'
+	)
+	ap.add_argument(
+		'-p',
+		'--processes',
+		type = int,
+		default = None,
+		help = 'Worker processes, every core by default'
+	)
+	ap.add_argument(
+		'--abandon-margin',
+		type = float,
+		default = None,
+		help = 'Abandon restarts whose MSE is this much above the best one'
+	)
+	ap.add_argument(
+		'--abandon-after',
+		type = int,
+		default = 3,
+		help = 'Iterations a restart runs before it can be abandoned'
+	)
+	ap.add_argument(
+		'-e',
+		'--engine',
+		default = 'lloyd',
+		choices = ENGINES,
+		help = 'k-means engine'
+	)
+	ap.add_argument(
+		'-o',
+		'--output',
+		default = './compressed',
+		help = 'Output directory'
+	)
+	ap.add_argument(
+		'-v',
+		'--verbosity',
+		type = int,
+		default = 0,
+		help = 'Verbosity level'
+	)
+	args = ap.parse_args()
+
+	utils.vlevel = args.verbosity
+	if(not os.path.isdir(args.output)):
+		os.makedirs(args.output)
+
+	image, best_mse, best_aid, time_profile = multi_start(
+		args.image, args.colors,
+		restarts = args.restarts,
+		seed = args.seed,
+		processes = args.processes,
+		abandon_margin = args.abandon_margin,
+		abandon_after = args.abandon_after,
+		engine = args.engine
+	)
+
+	im_name = os.path.splitext(os.path.basename(args.image))[0]
+	for name, result in [('random_mse', best_mse), ('random_aid', best_aid)]:
+		r_seed, _, compressed_image, mse, aid = result
+		cv2.imwrite(os.path.join(args.output, '{}_{}_{}colors.png'.format(im_name, name, args.colors)), compressed_image)
+		print('{}: seed {}, MSE {}, AID {}'.format(name, r_seed, mse, aid))
+
+	print('Time profile')
+	for metric, value in time_profile.items():
+		print('{}: {}'.format(metric, value))
@@ -0,0 +1,167 @@
+import numpy as np
+import hashlib
+import os
+from utils import function_name
+
+# Size the cache directory is kept under by default
+MAX_BYTES = 512 * 2**20
+
+# Keyword arguments of k_means that don't change its result
+IGNORED_ARGS = [
+	'workers', 'chunk_size', 'uniques',
+	'checkpoint', 'checkpoint_iters', 'checkpoint_seconds', 'resume',
+	'trace', 'callback'
+]
+
+class PaletteCache(object):
+	"""
+	on-disk cache of k-means results, every entry is an npz file with
+	the means, the cluster of every pixel in the smallest uint that
+	holds k and the mse, named after the hash of the pixels and the
+	parameters that produced it
+
+	Entries are touched when read so the least recently used ones are
+	removed first once the directory goes over max_bytes
+
+	cache_dir: string
+	max_bytes: int
+	hits: int
+	misses: int
+	"""
+
+	def __init__(self, cache_dir, max_bytes = MAX_BYTES):
+		self.cache_dir = cache_dir
+		self.max_bytes = max_bytes
+		self.hits = 0
+		self.misses = 0
+
+		if(not os.path.isdir(cache_dir)):
+			os.makedirs(cache_dir)
+
+	def key(self, data, k, init_f, distance_f, kmeans_args):
+		"""
+		returns the key of a k-means run, the hash of the data together
+		with every parameter that changes its result
+
+		Arguments:
+		data: numpy 2d numerical array
+		k: int
+		init_f: function of 2d array x 1d array x int x function -> 2d array
+		distance_f: function of datapoint x datapoint -> float
+		kmeans_args: dict of keyword arguments for kmeans.k_means
+
+		Output:
+		key: string
+		"""
+		h = hashlib.sha1()
+		h.update(np.ascontiguousarray(data).tobytes())
+		h.update(repr((data.shape, str(data.dtype), k)).encode())
+		h.update(function_name(init_f).encode())
+		h.update(function_name(distance_f).encode())
+
+		for name in sorted(kmeans_args):
+			if(name in IGNORED_ARGS):
+				continue
+			value = kmeans_args[name]
+			h.update(name.encode())
+			if(isinstance(value, np.ndarray)):
+				h.update(np.ascontiguousarray(value).tobytes())
+			elif(callable(value)):
+				h.update(function_name(value).encode())
+			else:
+				h.update(repr(value).encode())
+
+		return h.hexdigest()
+
+	def path(self, key):
+		return os.path.join(self.cache_dir, key + '.npz')
+
+	def get(self, key):
+		"""
+		returns the entry stored under key or None, counting the hit or
+		miss
+
+		Arguments:
+		key: string
+
+		Output:
+		entry: (c_means, clusters, mse) or None
+		"""
+		path = self.path(key)
+		try:
+			with np.load(path) as entry:
+				c_means = entry['c_means']
+				clusters = entry['clusters']
+				mse = float(entry['mse'])
+		except (IOError, OSError, KeyError, ValueError):
+			# Missing, evicted meanwhile or half written by someone else
+			self.misses += 1
+			return None
+
+		# Mark as recently used
+		try:
+			os.utime(path, None)
+		except OSError:
+			pass
+		self.hits += 1
+
+		return c_means, clusters, mse
+
+	def put(self, key, c_means, clusters, mse):
+		"""
+		stores an entry and evicts the least recently used ones if the
+		cache went over its size
+
+		Arguments:
+		key: string
+		c_means: numpy 2d numerical array
+		clusters: numpy 1d numerical array
+		mse: float
+		"""
+		# Written under a temporary name and renamed so readers never see
+		# a partial file
+		path = self.path(key)
+		tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+		with open(tmp_path, 'wb') as f:
+			np.savez(f, c_means = c_means, clusters = clusters, mse = np.float64(mse))
+		os.replace(tmp_path, path)
+
+		self.evict()
+
+	def evict(self):
+		"""
+		removes the least recently used entries until the cache fits in
+		max_bytes
+		"""
+		entries = []
+		total = 0
+		for file in os.listdir(self.cache_dir):
+			if(not file.endswith('.npz')):
+				continue
+			try:
+				stat = os.stat(os.path.join(self.cache_dir, file))
+			except OSError:
+				continue
+			entries.append((stat.st_mtime, stat.st_size, file))
+			total += stat.st_size
+
+		entries.sort()
+		for _, size, file in entries:
+			if(total <= self.max_bytes):
+				break
+			try:
+				os.remove(os.path.join(self.cache_dir, file))
+			except OSError:
+				pass
+			total -= size
+
+	def stats(self):
+		"""
+		returns the hit and miss counts of this cache object
+		"""
+		lookups = self.hits + self.misses
+		return {
+			'cache_hits': self.hits,
+			'cache_misses': self.misses,
+			'cache_hit_rate': self.hits / lookups if lookups > 0 else 0.0
+		}
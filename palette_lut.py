@@ -0,0 +1,189 @@
+import numpy as np
+from rgb_distance import rgb_distance
+from assignment import assign, BOUND_MARGIN
+from indexed_image import IndexedImage
+from kmeans import get_spuid
+
+# Bits per channel of the cells classified with box bounds when a full
+# 8 bit table is built, only colors in cells touching a cluster
+# boundary are assigned one by one
+COARSE_BITS = 5
+
+# Amount of cells bounded at once
+CELL_CHUNK = 1024
+
+class PaletteLUT(object):
+	"""
+	color to cluster lookup table, the entry of a color quantized to
+	bits per channel is the index of its nearest mean, entries equal to
+	the amount of means mark cells where more than one mean can be the
+	nearest, their pixels are assigned exactly when the table is applied
+
+	table: numpy 1d uint array with 2^(3*bits) entries, indexed by
+	r | g << bits | b << 2*bits
+	means: numpy 2d float32 array with shape [k, 3] in rgb
+	"""
+
+	def __init__(self, table, means, distance_f = rgb_distance):
+		self.table = table
+		self.means = means
+		self.palette = means.astype(np.uint8)
+		self.distance_f = distance_f
+		self.bits = int(round(np.log2(table.shape[0]) / 3))
+		self.ambiguous = means.shape[0]
+
+	def lookup(self, pixels):
+		"""
+		returns the cluster of every pixel
+
+		Arguments:
+		pixels: numpy 2d uint8 array with shape [n, 3] in rgb
+
+		Output:
+		clusters: numpy 1d numerical array
+		"""
+		shift = 8 - self.bits
+		idx = (pixels[:, 0] >> shift).astype(np.intp)
+		idx |= (pixels[:, 1] >> shift).astype(np.intp) << self.bits
+		idx |= (pixels[:, 2] >> shift).astype(np.intp) << 2*self.bits
+		clusters = self.table[idx]
+
+		# Exact assignment of the pixels of boundary cells
+		refine = np.flatnonzero(clusters == self.ambiguous)
+		if(refine.shape[0] > 0):
+			exact = np.ndarray([refine.shape[0]], dtype = clusters.dtype)
+			assign(pixels[refine], self.means, exact, self.distance_f)
+			clusters[refine] = exact
+
+		return clusters
+
+	def apply(self, image, bgr = False):
+		"""
+		returns an image quantized to the palette
+
+		Arguments:
+		image: numpy 3d uint8 array
+		bgr: bool, the image channels are in bgr order
+
+		Output:
+		compressed_image: IndexedImage
+		"""
+		pixels = image.reshape([-1, 3])
+		if(bgr):
+			pixels = pixels[:, ::-1]
+		clusters = self.lookup(pixels)
+
+		return IndexedImage(clusters.reshape(image.shape[:2]), self.palette)
+
+	def save(self, prefix):
+		"""
+		writes the table and the means into prefix_table.npy and
+		prefix_means.npy
+		"""
+		np.save(prefix + '_table.npy', self.table)
+		np.save(prefix + '_means.npy', self.means)
+
+def load_lut(prefix, mmap = True, distance_f = rgb_distance):
+	"""
+	reads a table written by PaletteLUT.save
+
+	Arguments:
+	prefix: string
+	mmap: bool, memory map the table instead of reading it
+	distance_f: function of datapoint x datapoint -> float
+
+	Output:
+	lut: PaletteLUT
+	"""
+	if(mmap):
+		table = np.load(prefix + '_table.npy', mmap_mode = 'r')
+	else:
+		table = np.load(prefix + '_table.npy')
+	means = np.load(prefix + '_means.npy')
+
+	return PaletteLUT(table, means, distance_f)
+
+def build_lut(means, bits = 8, distance_f = rgb_distance):
+	"""
+	builds the lookup table of a palette, with 8 bits per channel the
+	table is exact and needs no refinement when applied
+
+	Arguments:
+	means: numpy 2d numerical array with shape [k, 3] in rgb
+	bits: int, bits per channel of the table
+	distance_f: function of datapoint x datapoint -> float, it needs a
+	box_bounds attribute
+
+	Output:
+	lut: PaletteLUT
+	"""
+	if(bits < 1 or bits > 8):
+		raise ValueError('bits must be between 1 and 8, got {}'.format(bits))
+
+	means = means.astype(np.float32)
+	if(bits < 8):
+		return PaletteLUT(cell_table(means, bits, distance_f), means, distance_f)
+
+	# Expand the coarse cells to every color and assign exactly the
+	# colors of the boundary cells
+	# Once refined the table only holds the k clusters, get_spuid(k)
+	# still fits the marker k of the coarse cells
+	k = means.shape[0]
+	coarse = cell_table(means, COARSE_BITS, distance_f).astype(get_spuid(k))
+	side = 2**COARSE_BITS
+	repeat = 2**(8 - COARSE_BITS)
+	table = coarse.reshape([side, side, side])
+	table = table.repeat(repeat, axis = 0).repeat(repeat, axis = 1).repeat(repeat, axis = 2)
+	table = table.reshape([-1])
+
+	refine = np.flatnonzero(table == k)
+	colors = np.ndarray([refine.shape[0], 3], dtype = np.uint8)
+	for i in range(3):
+		colors[:, i] = (refine >> 8*i) & 0xFF
+	exact = np.ndarray([refine.shape[0]], dtype = table.dtype)
+	assign(colors, means, exact, distance_f)
+	table[refine] = exact
+
+	return PaletteLUT(table, means, distance_f)
+
+def cell_table(means, bits, distance_f):
+	"""
+	returns for every cell of a grid with bits per channel the only
+	mean that can be the nearest to its colors, or k when there are
+	more than one
+
+	Arguments:
+	means: numpy 2d float32 array with shape [k, 3]
+	bits: int
+	distance_f: function of datapoint x datapoint -> float
+
+	Output:
+	table: numpy 1d uint array with 2^(3*bits) entries
+	"""
+	box_bounds = getattr(distance_f, 'box_bounds', None)
+	if(box_bounds is None):
+		error_msg = 'The lookup table needs a distance function'
+		error_msg += ' with a box_bounds attribute'
+		raise ValueError(error_msg)
+
+	k = means.shape[0]
+	side = 2**bits
+	width = 2**(8 - bits)
+	table = np.ndarray([side**3], dtype = get_spuid(k + 1))
+
+	for start in range(0, table.shape[0], CELL_CHUNK):
+		cells = np.arange(start, min(start + CELL_CHUNK, table.shape[0]))
+		lo = np.ndarray([cells.shape[0], 1, 3], dtype = np.float64)
+		for i in range(3):
+			lo[:, 0, i] = ((cells >> bits*i) & (side - 1)) * width
+		hi = lo + (width - 1)
+
+		lower, upper = box_bounds(lo, hi, means)
+		best = np.min(upper, axis = 1)
+		candidates = lower <= best[:, np.newaxis] * (1 + BOUND_MARGIN)
+
+		# Cells with a single candidate get it, the rest are ambiguous
+		single = np.sum(candidates, axis = 1) == 1
+		table[cells] = np.where(single, np.argmax(candidates, axis = 1), k)
+
+	return table
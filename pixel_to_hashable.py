@@ -69,6 +69,40 @@ def int_to_pixel(int_pixel):
 	
 	return pixel
 
+def pixels_to_int(pixels):
+	"""
+	returns the integer representation of every pixel, same as
+	pixel_to_int but for a whole array at once
+	
+	Arguments:
+	pixels: numpy 2d uint8 array with shape [n, 3]
+	
+	Output:
+	integers: numpy 1d uint32 array
+	"""
+	integers = pixels[:, 0].astype(np.uint32)
+	integers |= pixels[:, 1].astype(np.uint32) << 8
+	integers |= pixels[:, 2].astype(np.uint32) << 16
+	
+	return integers
+	
+def ints_to_pixels(int_pixels):
+	"""
+	returns the pixels represented by an array of integers, inverse of
+	pixels_to_int
+	
+	Arguments:
+	int_pixels: numpy 1d numerical array
+	
+	Output: numpy 2d uint8 array with shape [n, 3]
+	"""
+	pixels = np.ndarray([int_pixels.shape[0], 3], dtype = np.uint8)
+	
+	for i in range(3):
+		pixels[:, i] = (int_pixels >> i*8) & 0xFF
+	
+	return pixels
+
 if __name__ == '__main__':
 	times_np = []
 	times_str = []
@@ -1,127 +1,396 @@
 from image_compressor import compress_image
+from kmeans import get_uniques_inverse, ENGINES
 from initializers.fft import deterministic_fft
 from initializers.uniform_mode_dist import uniform_mode_dist_init
 from initializers.random_init import random_init
-import utils
-from collections import defaultdict
+from functools import partial
+import numpy as np
+import argparse
+import tracemalloc
+import time
+import csv
 import cv2
 import os
+import sys
+import utils
 
-class DataRow(object):
-
-	def __init__(self, im_name, init_method, colors, mse, aid, time_profile):
-		self.im_name = im_name
-		self.init_method = init_method
-		self.colors = colors
-		self.mse = mse
-		self.aid = aid
-		self.unique_mapping = time_profile['unique_mapping']
-		self.init_point_selection = time_profile['init_point_selection']
-		self.unique_demapping = time_profile['unique_demapping']
-		self.k_means = time_profile['k_means']
-
-def best_random(n_cases = 100):
-	best_mse = float('inf')
-	best_mse_aid = ''
-	best_aid = float('inf')
-	best_aid_mse = ''
-	best_compressed = None
-	best_compressed_aid = None
-	total_time_profile = defaultdict(float)
-
-	for _ in range(n_cases):
-		image, compressed, mse, aid, time_profile = compress_image(im_path, c, random_init)
-
-		# Select best mse
-		if(mse < best_mse):
-			best_mse = mse
-			best_mse_aid = aid
-			best_compressed = compressed
-
-		# Select best aid
-		if(aid < best_aid):
-			best_aid = aid
-			best_aid_mse = mse
-			best_compressed_aid = compressed
-
-		# add times
-		for key, value in time_profile.items():
-			total_time_profile[key] += value
-
-	return image, best_compressed, best_mse, best_mse_aid, best_compressed_aid, best_aid_mse, best_aid, total_time_profile,
-
-def generate_csv(out_path, data_rows):
-
-	time_unit = 's'
-	string = ''
-	string += 'im_name,init_method,colors,mse,aid,unique_mapping_time({0}),init_point_selection_time({0}),unique_demapping_time({0}),k_means_time({0})\n'.format(time_unit)
-
-	for row in data_rows:
-		string += row.im_name + ','
-		string += row.init_method + ','
-		string += str(row.colors) + ','
-		string += str(row.mse) + ','
-		string += str(row.aid) + ','
-		string += str(row.unique_mapping) + ','
-		string += str(row.init_point_selection) + ','
-		string += str(row.unique_demapping) + ','
-		string += str(row.k_means) + '\n'
-
-	with open(out_path, 'w') as f:
-		f.write(string)
+INITIALIZERS = {
+	'fft': deterministic_fft,
+	'umdi': uniform_mode_dist_init,
+	'random': random_init
+}
 
+IMAGE_KINDS = ['gradient', 'noise', 'flat', 'photo']
 
-if __name__ == '__main__':
-	if(os.name == 'nt'):
-		folder_sep = '\\'
-	elif(os.name == 'posix'):
-		folder_sep = '/'
+# Columns of profile4.csv followed by the ones added by this suite,
+# baselines in the old schema are still read
+BASE_FIELDS = [
+	'im_name', 'init_method', 'colors', 'mse', 'aid',
+	'unique_mapping_time(s)', 'init_point_selection_time(s)',
+	'unique_demapping_time(s)', 'k_means_time(s)'
+]
+EXTRA_FIELDS = [
+	'engine', 'unique_colors', 'iterations', 'distance_evaluations',
+	'wall_time(s)', 'peak_memory(MB)'
+]
+
+def synthetic_image(kind, height, width, levels = None, seed = 0):
+	"""
+	returns a deterministic synthetic image in rgb
+
+	Arguments:
+	kind: string, 'gradient' smooth ramps, 'noise' uniform noise, 'flat'
+	blocks of a few colors, 'photo' smooth shapes with correlated
+	channels and sensor-like noise
+	height: int
+	width: int
+	levels: int or None, values per channel the image is quantized to,
+	it bounds the amount of unique colors
+	seed: int
+
+	Output:
+	image: numpy 3d uint8 array with shape [height, width, 3]
+	"""
+	rand_state = np.random.RandomState(seed)
+	y, x = np.mgrid[0:height, 0:width].astype(np.float64)
+	y /= max(height - 1, 1)
+	x /= max(width - 1, 1)
+
+	if(kind == 'gradient'):
+		image = np.stack([x, y, (x + y) / 2], axis = 2) * 255
+	elif(kind == 'noise'):
+		image = rand_state.randint(0, 256, [height, width, 3]).astype(np.float64)
+	elif(kind == 'flat'):
+		# Regions of a coarse grid painted with a small palette
+		palette = rand_state.randint(0, 256, [8, 3])
+		cells = rand_state.randint(0, 8, [8, 8])
+		rows = np.minimum((y * 8).astype(int), 7)
+		cols = np.minimum((x * 8).astype(int), 7)
+		image = palette[cells[rows, cols]].astype(np.float64)
+	elif(kind == 'photo'):
+		# A shared luminance of low frequency waves tinted per channel
+		luminance = np.zeros([height, width])
+		for _ in range(4):
+			fy, fx = rand_state.uniform(0.5, 3, 2)
+			phase = rand_state.uniform(0, 2*np.pi)
+			luminance += np.sin(2*np.pi*(fy*y + fx*x) + phase)
+		luminance = (luminance - luminance.min()) / max(np.ptp(luminance), 1e-9)
+		tint = rand_state.uniform(0.6, 1.0, 3)
+		offset = rand_state.uniform(0, 60, 3)
+		image = luminance[:, :, np.newaxis] * tint * 195 + offset
+		image += rand_state.normal(0, 6, [height, width, 3])
 	else:
-		print('I can only run on Linux and Windows')
-		exit()
+		raise ValueError('Unknown image kind {}'.format(kind))
+
+	if(levels is not None):
+		step = 255 / (levels - 1)
+		image = np.round(np.clip(image, 0, 255) / step) * step
+
+	return np.clip(np.round(image), 0, 255).astype(np.uint8)
+
+def generate_images(out_dir, sizes, kinds = IMAGE_KINDS, levels = [None], seed = 0):
+	"""
+	writes every synthetic image of the suite into out_dir as png, the
+	same arguments always give the same images
+
+	Arguments:
+	out_dir: string
+	sizes: list of (int, int)
+	kinds: list of string
+	levels: list of int or None
+	seed: int
+
+	Output:
+	im_paths: list of string
+	"""
+	if(not os.path.isdir(out_dir)):
+		os.makedirs(out_dir)
+
+	im_paths = []
+	for kind in kinds:
+		for height, width in sizes:
+			for level in levels:
+				name = '{}_{}x{}'.format(kind, width, height)
+				if(level is not None):
+					name += '_{}levels'.format(level)
+				image = synthetic_image(kind, height, width, level, seed)
+
+				im_path = os.path.join(out_dir, name + '.png')
+				cv2.imwrite(im_path, cv2.cvtColor(image, cv2.COLOR_RGB2BGR))
+				im_paths.append(im_path)
+
+	return im_paths
 
-	if(not os.path.exists('profile_images')):
-		raise Exception('\'profile_images\' folder not found')
+def count_colors(im_path):
+	"""
+	returns the amount of unique colors of an image
+	"""
+	image = cv2.cvtColor(cv2.imread(im_path), cv2.COLOR_BGR2RGB).reshape([-1, 3])
 
-	im_paths = ['profile_images{}'.format(folder_sep) + file for file in os.listdir('profile_images')]
-	#colors = [4, 8, 16, 32, 64]
-	colors = [16]
+	return get_uniques_inverse(image)[0].shape[0]
 
-	out_path = 'profile.csv'
-	compressed_file_template = 'profile_compressed{}{}_{}_{}colors.png'
-	data_rows = []
-	n_cases = len(colors) * len(im_paths)
-	i = 1
+def run_case(im_path, k, init_method, engine, unique_colors, seed = 0, **kmeans_args):
+	"""
+	compresses an image once and returns its row of the benchmark
 
-	utils.vlevel = 1
+	Arguments:
+	im_path: string
+	k: int
+	init_method: string, key of INITIALIZERS
+	engine: string
+	unique_colors: int, count_colors of the image
+	seed: int, seed of the random initializer and the mini-batches
+	kmeans_args: keyword arguments for kmeans.k_means
 
-	for c in colors:
-		for im_path in im_paths:
-			print('Case{}/{}'.format(i, n_cases))
-			i = i+1
-			im_name = im_path.split(folder_sep)[-1].split('.')[:-1][0]
+	Output:
+	row: dict of string -> value
+	"""
+	# The random initializer gets its own generator so cases don't depend
+	# on the global one
+	init_f = INITIALIZERS[init_method]
+	if(init_f is random_init):
+		init_f = partial(random_init, rand_state = np.random.RandomState(seed))
 
-			# Random init
-			image, compressed_mse, mse_mse, mse_aid, compressed_aid, aid_mse, aid_aid, time_profile = best_random(10)
-			data_rows.append(DataRow(im_name, 'random_mse', c, mse_mse, mse_aid, time_profile))
-			cv2.imwrite(compressed_file_template.format(folder_sep, im_name, 'random_mse', c), compressed_mse)
+	# Tracing is stopped even when a case fails, so it doesn't slow down
+	# the next ones
+	tracemalloc.start()
+	try:
+		t0 = time.perf_counter()
+		_, _, mse, aid, time_profile = compress_image(
+			im_path, k, init_f,
+			engine = engine, seed = seed, **kmeans_args
+		)
+		t1 = time.perf_counter()
+		peak = tracemalloc.get_traced_memory()[1]
+	finally:
+		tracemalloc.stop()
+
+	return {
+		'im_name': os.path.splitext(os.path.basename(im_path))[0],
+		'init_method': init_method,
+		'colors': k,
+		'mse': mse,
+		'aid': aid,
+		'unique_mapping_time(s)': time_profile['unique_mapping'],
+		'init_point_selection_time(s)': time_profile['init_point_selection'],
+		'unique_demapping_time(s)': time_profile['unique_demapping'],
+		'k_means_time(s)': time_profile['k_means'],
+		'engine': engine,
+		'unique_colors': unique_colors,
+		'iterations': time_profile.get('iterations', 0),
+		'distance_evaluations': time_profile['distance_evaluations'],
+		'wall_time(s)': t1 - t0,
+		'peak_memory(MB)': peak / 2**20
+	}
+
+def write_csv(out_path, rows):
+	"""
+	writes the benchmark rows in the profile4.csv schema with the extra
+	columns of the suite
+	"""
+	with open(out_path, 'w', newline = '') as f:
+		writer = csv.DictWriter(f, BASE_FIELDS + EXTRA_FIELDS)
+		writer.writeheader()
+		writer.writerows(rows)
+
+def read_csv(path):
+	"""
+	reads a benchmark or a profile4.csv style file, rows without an
+	engine column are taken as lloyd runs
+
+	Output:
+	rows: dict of (im_name, init_method, colors, engine) -> dict of
+	string -> string
+	"""
+	rows = {}
+	with open(path, newline = '') as f:
+		for row in csv.DictReader(f):
+			engine = row.get('engine') or 'lloyd'
+			rows[(row['im_name'], row['init_method'], int(row['colors']), engine)] = row
+
+	return rows
+
+def compare(rows, baseline, time_tol = 0.25, mse_tol = 0.001, memory_tol = 0.25, min_time = 0.05):
+	"""
+	returns the regressions of rows against a baseline and the amount
+	of rows that had a baseline case, a metric regresses when it grows
+	more than its relative tolerance, times shorter than min_time in
+	both runs are too noisy to be compared
+
+	Arguments:
+	rows: list of dict of string -> value
+	baseline: read_csv output
+	time_tol: float
+	mse_tol: float
+	memory_tol: float
+	min_time: float
+
+	Output:
+	regressions: list of string
+	compared: int
+	"""
+	checks = [
+		('k_means_time(s)', time_tol),
+		('mse', mse_tol),
+		('aid', mse_tol),
+		('peak_memory(MB)', memory_tol)
+	]
+
+	regressions = []
+	compared = 0
+	for row in rows:
+		key = (row['im_name'], row['init_method'], row['colors'], row['engine'])
+		if(key not in baseline):
+			continue
+		compared += 1
+
+		for field, tol in checks:
+			old = baseline[key].get(field)
+			if(old is None or old == ''):
+				continue
+			old = float(old)
+			new = float(row[field])
+			if(field.endswith('time(s)') and max(old, new) < min_time):
+				continue
+
+			if(new > old * (1 + tol)):
+				regressions.append('{} {} {} colors {}: {} {:.6g} -> {:.6g} ({:+.1%})'.format(
+					key[0], key[1], key[2], key[3], field, old, new, (new - old) / max(old, 1e-12)
+				))
+
+	return regressions, compared
+
+if __name__ == '__main__':
 
-			data_rows.append(DataRow(im_name, 'random_aid', c, aid_mse, aid_aid, time_profile))
-			cv2.imwrite(compressed_file_template.format(folder_sep, im_name, 'random_aid', c), compressed_aid)
+	# Script arguments
+	ap = argparse.ArgumentParser(
+		description = 'Benchmark the compressor on deterministic synthetic images'
+	)
+	ap.add_argument(
+		'--sizes',
+		nargs = '+',
+		default = ['64x64', '256x256'],
+		help = 'Image sizes as WIDTHxHEIGHT'
+	)
+	ap.add_argument(
+		'--kinds',
+		nargs = '+',
+		default = IMAGE_KINDS,
+		choices = IMAGE_KINDS,
+		help = 'Synthetic image kinds'
+	)
+	ap.add_argument(
+		'--levels',
+		nargs = '+',
+		type = int,
+		default = [0, 16],
+		help = 'Values per channel the images are quantized to, 0 keeps every value'
+	)
+	ap.add_argument(
+		'-c',
+		'--colors',
+		nargs = '+',
+		type = int,
+		default = [4, 16, 64],
+		help = 'Number of colors'
+	)
+	ap.add_argument(
+		'-e',
+		'--engines',
+		nargs = '+',
+		default = ['lloyd', 'hamerly', 'kdtree', 'minibatch'],
+		choices = ENGINES,
+		help = 'k-means engines'
+	)
+	ap.add_argument(
+		'--inits',
+		nargs = '+',
+		default = ['fft', 'umdi', 'random'],
+		choices = sorted(INITIALIZERS.keys()),
+		help = 'Initializers'
+	)
+	ap.add_argument(
+		'--seed',
+		type = int,
+		default = 0,
+		help = 'Seed of the images, the random initializer and the mini-batches'
+	)
+	ap.add_argument(
+		'--images-dir',
+		default = 'benchmark_images',
+		help = 'Directory the synthetic images are written to'
+	)
+	ap.add_argument(
+		'-o',
+		'--output',
+		default = 'benchmark.csv',
+		help = 'Results file'
+	)
+	ap.add_argument(
+		'-b',
+		'--baseline',
+		default = None,
+		help = 'Results of a previous run to compare with'
+	)
+	ap.add_argument(
+		'--time-tol',
+		type = float,
+		default = 0.25,
+		help = 'Relative k-means time increase flagged as a regression'
+	)
+	ap.add_argument(
+		'--mse-tol',
+		type = float,
+		default = 0.001,
+		help = 'Relative MSE and AID increase flagged as a regression'
+	)
+	ap.add_argument(
+		'--memory-tol',
+		type = float,
+		default = 0.25,
+		help = 'Relative peak memory increase flagged as a regression'
+	)
+	args = ap.parse_args()
 
-			# FFT init
-			_, compressed, mse, aid, time_profile = compress_image(im_path, c, deterministic_fft)
-			data_rows.append(DataRow(im_name, 'fft', c, mse, aid, time_profile))
-			cv2.imwrite(compressed_file_template.format(folder_sep, im_name, 'fft', c), compressed)
+	utils.vlevel = 0
 
-			# UMDI
-			_, compressed, mse, aid, time_profile = compress_image(im_path, c, uniform_mode_dist_init)
-			data_rows.append(DataRow(im_name, 'umdi', c, mse, aid, time_profile))
-			cv2.imwrite(compressed_file_template.format(folder_sep, im_name, 'umdi', c), compressed)
+	sizes = [tuple(int(v) for v in size.split('x'))[::-1] for size in args.sizes]
+	levels = [level if level > 0 else None for level in args.levels]
+	im_paths = generate_images(args.images_dir, sizes, args.kinds, levels, args.seed)
 
-			if(not os.path.exists('profile_compressed{}{}_original.png'.format(folder_sep, im_name))):
-				cv2.imwrite('profile_compressed{}{}_original.png'.format(folder_sep, im_name), image)
+	# Images with fewer colors than k are skipped for that k
+	unique_colors = dict((im_path, count_colors(im_path)) for im_path in im_paths)
+	cases = [
+		(im_path, k, init_method, engine)
+		for im_path in im_paths
+		for k in args.colors
+		for init_method in args.inits
+		for engine in args.engines
+		if k <= unique_colors[im_path]
+	]
 
-	generate_csv(out_path, data_rows)
+	rows = []
+	for i, (im_path, k, init_method, engine) in enumerate(cases):
+		row = run_case(im_path, k, init_method, engine, unique_colors[im_path], args.seed)
+		rows.append(row)
+		print('Case {}/{}: {} {} colors {} {}: {:.3f}s, {} iterations, {:.1f} MB'.format(
+			i + 1, len(cases), row['im_name'], k, init_method, engine,
+			row['k_means_time(s)'], row['iterations'], row['peak_memory(MB)']
+		))
 
+	write_csv(args.output, rows)
+	print('Results written to', args.output)
 
+	if(args.baseline is not None):
+		regressions, compared = compare(rows, read_csv(args.baseline), args.time_tol, args.mse_tol, args.memory_tol)
+		print('Compared {} of {} cases against {}'.format(compared, len(rows), args.baseline))
+		# A baseline with none of the cases checks nothing
+		if(compared == 0):
+			print('No case of this run is in', args.baseline)
+			sys.exit(1)
+		if(regressions):
+			print('Regressions against', args.baseline)
+			for regression in regressions:
+				print(regression)
+			sys.exit(1)
+		print('No regressions against', args.baseline)
@@ -1,6 +1,23 @@
 import numpy as np
 import time
 
+def red_weights(r):
+	"""
+	returns the weights of the red and blue channels for a red mean
+
+	Arguments:
+	r: float32/numpy float32 numerical array
+
+	Output:
+	r_weight: float32/numpy float32 numerical array
+	b_weight: float32/numpy float32 numerical array
+	"""
+	return 2+(r/256), (2+(255-r))/256
+
+# Red and blue weights indexed by the sum of the red values of two
+# integer pixels, that is twice their red mean
+RED_SUM_R_WEIGHT, RED_SUM_B_WEIGHT = red_weights(np.arange(511, dtype = np.float32)/2)
+
 def rgb_distance(p1, p2):
 	"""
 	Arguments:
@@ -21,11 +38,109 @@ def rgb_distance(p1, p2):
 	else:
 		p1, p2 = np.atleast_2d(p1, p2)
 		r = (p1[:, 0] + p2[:, 0])/2
-		s = np.array([[2+(v/256), 4, (2+(255-v))/256] for v in r], dtype = np.float32)
+		r_weight, b_weight = red_weights(r)
+		s = np.empty([r.shape[0], 3], dtype = np.float32)
+		s[:, 0] = r_weight
+		s[:, 1] = 4
+		s[:, 2] = b_weight
 		px = p2 - p1
 		dis = np.sqrt(np.sum(px*px*s, axis = 1))
 		
 	return dis
+
+def rgb_pairwise_distance(p1, p2, squared = False):
+	"""
+	returns the distance between every pixel of p1 and every pixel of
+	p2, when both are integer arrays the channel weights are looked up
+	by the sum of their red values instead of being computed
+
+	Arguments:
+	p1: numpy 2d numerical array with shape [n, 3]
+	p2: numpy 2d numerical array with shape [k, 3]
+	squared: bool, skip the square root
+
+	Output:
+	dis: numpy 2d float32 array with shape [n, k]
+	"""
+	if(np.issubdtype(p1.dtype, np.integer) and np.issubdtype(p2.dtype, np.integer)):
+		red_sum = p1[:, 0].astype(np.intp)[:, np.newaxis] + p2[:, 0]
+		r_weight = RED_SUM_R_WEIGHT[red_sum]
+		b_weight = RED_SUM_B_WEIGHT[red_sum]
+	else:
+		r = (p1[:, 0].astype(np.float32)[:, np.newaxis] + p2[:, 0].astype(np.float32))/2
+		r_weight, b_weight = red_weights(r)
+
+	p1 = p1.astype(np.float32)
+	p2 = p2.astype(np.float32)
+
+	# Accumulate channel by channel to only hold [n, k] temporaries
+	px = p2[:, 0] - p1[:, 0, np.newaxis]
+	dis = px*px*r_weight
+	px = p2[:, 1] - p1[:, 1, np.newaxis]
+	dis += px*px*np.float32(4)
+	px = p2[:, 2] - p1[:, 2, np.newaxis]
+	dis += px*px*b_weight
+
+	if(not squared):
+		np.sqrt(dis, out = dis)
+
+	return dis
+
+def interval_sq(lo, hi):
+	"""
+	returns the minimum and maximum of x*x for x in [lo, hi]
+	"""
+	lo_sq = lo*lo
+	hi_sq = hi*hi
+	sq_min = np.where((lo <= 0) & (hi >= 0), 0, np.minimum(lo_sq, hi_sq))
+
+	return sq_min, np.maximum(lo_sq, hi_sq)
+
+def rgb_box_bounds(lo, hi, p2):
+	"""
+	returns a lower and an upper bound of the squared distance from any
+	pixel inside the box [lo, hi] to every pixel of p2, every term of
+	the distance is bounded on its own, many boxes can be bounded at
+	once giving lo and hi the shape [m, 1, 3]
+
+	Arguments:
+	lo: numpy 1d numerical array with shape [3] or [m, 1, 3]
+	hi: numpy 1d numerical array with shape [3] or [m, 1, 3]
+	p2: numpy 2d numerical array with shape [k, 3]
+
+	Output:
+	lower: numpy float64 array with shape [k] or [m, k]
+	upper: numpy float64 array with shape [k] or [m, k]
+	"""
+	p2 = p2.astype(np.float64)
+	sq_min, sq_max = interval_sq(lo - p2, hi - p2)
+
+	# Red and blue weights are monotonic on the red mean
+	r_lo = (lo[..., 0] + p2[:, 0])/2
+	r_hi = (hi[..., 0] + p2[:, 0])/2
+	r_weight_lo, b_weight_hi = red_weights(r_lo)
+	r_weight_hi, b_weight_lo = red_weights(r_hi)
+
+	lower = r_weight_lo*sq_min[..., 0] + 4*sq_min[..., 1] + b_weight_lo*sq_min[..., 2]
+	upper = r_weight_hi*sq_max[..., 0] + 4*sq_max[..., 1] + b_weight_hi*sq_max[..., 2]
+
+	return lower, upper
+
+# N x K kernel used by the assignment engine instead of pairing every
+# datapoint with every central point
+rgb_distance.pairwise = rgb_pairwise_distance
+
+# Bounds used by the kd-tree engine to discard central points
+rgb_distance.box_bounds = rgb_box_bounds
+
+# Bound of how much rgb_distance(x, p) can change when p moves by an
+# euclidean distance of 1 within [0, 255]^3, from the partial derivatives
+# of the distance: sqrt(3) + 255/(1024*sqrt(2/256)) for red, 2 for green
+# and sqrt(257/256) for blue. rgb_distance does not obey the triangle
+# inequality so bounds based on it use this instead
+rgb_distance.lipschitz = np.sqrt(
+	(np.sqrt(3) + 255/(1024*np.sqrt(2/256)))**2 + 2**2 + 257/256
+)
 	
 def test_func(p1, ps):
 	res = []
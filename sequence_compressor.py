@@ -0,0 +1,163 @@
+from kmeans import k_means, get_uniques_inverse, ENGINES
+from rgb_distance import rgb_distance
+from initializers.uniform_mode_dist import uniform_mode_dist_init
+from pixel_to_hashable import pixels_to_int
+from indexed_image import IndexedImage
+import numpy as np
+import argparse
+import time
+import cv2
+import os
+import utils
+
+def read_frames(frames_dir):
+	"""
+	yields the path and the image of every frame in a directory sorted
+	by name, frames are read only when they are asked for
+
+	Arguments:
+	frames_dir: string
+
+	Output:
+	generator of (string, numpy 3d numerical array)
+	"""
+	for file in sorted(os.listdir(frames_dir)):
+		if(os.path.splitext(file)[1].lower() not in utils.IMAGE_EXTENSIONS):
+			continue
+
+		path = os.path.join(frames_dir, file)
+		image = cv2.imread(path)
+		if(image is None):
+			raise ValueError('Could not read frame {}'.format(path))
+
+		yield path, image
+
+def compress_sequence(frames, k, init_f = uniform_mode_dist_init, **kmeans_args):
+	"""
+	compresses a stream of frames with k colors, only the first frame
+	is initialized with init_f, every other one starts from the means of
+	the previous frame and keeps the cluster its colors had there
+
+	Arguments:
+	frames: iterable of (string, numpy 3d numerical array) in bgr, like
+	read_frames
+	k: int
+	init_f: function of 2d array x 1d array x int x function -> 2d array
+	kmeans_args: keyword arguments for kmeans.k_means
+
+	Output:
+	generator of (string, IndexedImage, mse, time_profile)
+	"""
+	prev_means = None
+	prev_packed = None
+	prev_clusters = None
+
+	for path, image in frames:
+		t0 = time.perf_counter()
+		original_shape = image.shape
+		pixels = cv2.cvtColor(image, cv2.COLOR_BGR2RGB).reshape([-1, 3])
+
+		t1 = time.perf_counter()
+		uniques = get_uniques_inverse(pixels)
+		t2 = time.perf_counter()
+
+		# Clusters of the colors already present in the previous frame,
+		# unique colors come sorted by their packed value
+		packed = pixels_to_int(uniques[0])
+		if(prev_means is None):
+			init_clusters = None
+		else:
+			pos = np.searchsorted(prev_packed, packed)
+			pos[pos == prev_packed.shape[0]] = 0
+			found = prev_packed[pos] == packed
+			init_clusters = np.where(found, prev_clusters[pos], -1)
+
+		c_means, clusters, mse, time_profile = k_means(
+			pixels, k, rgb_distance, init_f,
+			uniques = uniques,
+			init_means = prev_means,
+			init_clusters = init_clusters,
+			**kmeans_args
+		)
+		time_profile['unique_mapping'] = t2 - t1
+
+		# Cluster of every unique color for the next frame
+		unique_clusters = np.ndarray([packed.shape[0]], dtype = np.intp)
+		unique_clusters[uniques[2]] = clusters
+		prev_means = c_means
+		prev_packed = packed
+		prev_clusters = unique_clusters
+
+		compressed_image = IndexedImage(clusters.reshape(original_shape[:2]), c_means.astype(np.uint8))
+		time_profile['frame_latency'] = time.perf_counter() - t0
+
+		yield path, compressed_image, mse, time_profile
+
+if __name__ == '__main__':
+
+	# Script arguments
+	ap = argparse.ArgumentParser(
+		description = 'Compress a sequence of frames with specified amount of colors'
+	)
+	ap.add_argument(
+		'-d',
+		'--frames',
+		required = True,
+		help = 'Directory with the frames, processed in name order'
+	)
+	ap.add_argument(
+		'-c',
+		'--colors',
+		required = True,
+		type = int,
+		help = 'Number of colors'
+	)
+	ap.add_argument(
+		'-o',
+		'--output',
+		default = './compressed',
+		help = 'Output directory'
+	)
+	ap.add_argument(
+		'-e',
+		'--engine',
+		default = 'lloyd',
+		choices = ENGINES,
+		help = 'k-means engine'
+	)
+	ap.add_argument(
+		'-w',
+		'--weighted',
+		action = 'store_true',
+		help = 'Weight every color by its pixel count'
+	)
+	ap.add_argument(
+		'-v',
+		'--verbosity',
+		type = int,
+		default = 1,
+		help = 'Verbosity level'
+	)
+	args = ap.parse_args()
+
+	utils.vlevel = args.verbosity
+	if(not os.path.isdir(args.output)):
+		os.makedirs(args.output)
+
+	latencies = []
+	sequence = compress_sequence(
+		read_frames(args.frames), args.colors,
+		engine = args.engine,
+		weighted = args.weighted
+	)
+	for path, compressed_image, mse, time_profile in sequence:
+		im_name = os.path.splitext(os.path.basename(path))[0]
+		compressed_image.write_png(os.path.join(args.output, '{}_{}colors.png'.format(im_name, args.colors)))
+
+		latencies.append(time_profile['frame_latency'])
+		print('{}: {:.3f}s, MSE {}'.format(im_name, time_profile['frame_latency'], mse))
+
+	if(latencies):
+		print('frames:', len(latencies))
+		print('mean latency:', np.mean(latencies), 's')
+		print('max latency:', np.max(latencies), 's')
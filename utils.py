@@ -2,6 +2,9 @@ from datetime import datetime
 
 vlevel = None
 
+# File extensions read as images when a directory is given
+IMAGE_EXTENSIONS = ['.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff', '.webp']
+
 def vprint(string, required_vlevel, time = True):
 	
 	if(time):
@@ -9,3 +12,9 @@ def vprint(string, required_vlevel, time = True):
 	
 	if(required_vlevel <= vlevel):
 		print(string)
+
+def function_name(f):
+	"""
+	returns a name that identifies a function across runs
+	"""
+	return '{}.{}'.format(getattr(f, '__module__', ''), getattr(f, '__qualname__', repr(f)))